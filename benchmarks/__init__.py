@@ -0,0 +1,13 @@
+"""
+Benchmarks of django-cache, run them from the project root:
+
+    python -m benchmarks.<name>
+"""
+
+import os
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+
+django.setup()
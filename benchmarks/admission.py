@@ -0,0 +1,110 @@
+"""
+Simulates the cache on Zipf-distributed trace of page requests and compares
+hit ratio of LRU cache without admission, with `admit_after` admission
+of the shared cache and with TinyLFU admission of L1 (`LocalCache`)
+"""
+
+from __future__ import print_function
+
+import argparse
+import bisect
+import collections
+import itertools
+import random
+import timeit
+
+from django.utils.six.moves import cPickle as pickle
+
+import benchmarks  # noqa: configures Django
+
+from djangocache import CountMinSketch, LocalCache
+
+PAGE = 'x' * 100
+
+
+def zipf_trace(pages, skew, requests, seed=0):
+    cumulative, total = [], 0
+    for rank in range(1, pages + 1):
+        total += 1.0 / rank ** skew
+        cumulative.append(total)
+    generator = random.Random(seed)
+    ranks = [bisect.bisect(cumulative, generator.random() * total) for _ in range(requests)]
+    # popular pages are not the ones with the smallest ids
+    ids = list(range(pages))
+    generator.shuffle(ids)
+    return ['/page/{}'.format(ids[rank]) for rank in ranks]
+
+
+def simulate_shared(trace, capacity, admit_after=None, sketch=None):
+    """
+    Shared cache is modeled as LRU of `capacity` pages (like memcached),
+    misses are counted by the sketch as the middleware does
+    """
+    entries = collections.OrderedDict()
+    hits = 0
+    for key in trace:
+        if key in entries:
+            entries[key] = entries.pop(key)
+            hits += 1
+            continue
+        if admit_after:
+            if sketch.add(key) < admit_after:
+                continue
+        entries[key] = True
+        if len(entries) > capacity:
+            entries.popitem(last=False)
+    return float(hits) / len(trace)
+
+
+def simulate_local(trace, capacity, sketch=None):
+    size = len(pickle.dumps(PAGE, pickle.HIGHEST_PROTOCOL))
+    local_cache = LocalCache(max_size=capacity * size, ttl=float('inf'), sketch=sketch)
+    for key in trace:
+        if local_cache.get(key) is None:
+            local_cache.set(key, PAGE)
+    stats = local_cache.stats()
+    return float(stats['hits']) / len(trace)
+
+
+def sketch_overhead(sketch, number=100000):
+    keys = itertools.cycle(['/page/{}'.format(i) for i in range(1000)])
+
+    return timeit.timeit(lambda: sketch.add(next(keys)), number=number) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=200000)
+    parser.add_argument('--pages', type=int, default=100000)
+    parser.add_argument('--capacity', type=int, default=1000, help='cache size in pages')
+    parser.add_argument('--skew', type=float, default=0.9, help='Zipf exponent')
+    parser.add_argument('--width', type=int, default=16384, help='sketch width')
+    parser.add_argument('--depth', type=int, default=4, help='sketch depth')
+    options = parser.parse_args()
+
+    def create_sketch():
+        return CountMinSketch(width=options.width, depth=options.depth)
+
+    trace = zipf_trace(options.pages, options.skew, options.requests)
+    print('{} requests of {} pages (Zipf {}), cache of {} pages, sketch of {} KB'.format(
+        options.requests,
+        options.pages,
+        options.skew,
+        options.capacity,
+        options.width * options.depth // 1024,
+    ))
+    print('{:<24} {:>10}'.format('policy', 'hit ratio'))
+    results = [
+        ('shared, no admission', simulate_shared(trace, options.capacity)),
+        ('shared, admit_after=2', simulate_shared(trace, options.capacity, 2, create_sketch())),
+        ('shared, admit_after=3', simulate_shared(trace, options.capacity, 3, create_sketch())),
+        ('L1, no admission', simulate_local(trace, options.capacity)),
+        ('L1, TinyLFU', simulate_local(trace, options.capacity, create_sketch())),
+    ]
+    for policy, hit_ratio in results:
+        print('{:<24} {:>10.3f}'.format(policy, hit_ratio))
+    print('sketch add (per miss): {:.2f} us'.format(sketch_overhead(create_sketch()) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Cache backends for benchmarks
+"""
+
+import time
+
+from django.core.cache.backends.locmem import LocMemCache
+
+
+class LatencyCache(LocMemCache):
+    """
+    Local memory cache simulating network round trip of remote caches
+    (memcached, Redis), round trip time in seconds is set by `LATENCY` option
+    """
+
+    def __init__(self, name, params):
+        super(LatencyCache, self).__init__(name, params)
+        self.latency = params.get('OPTIONS', {}).get('LATENCY', 0.001)
+        self.round_trips = 0
+
+    def round_trip(self):
+        self.round_trips += 1
+        time.sleep(self.latency)
+
+    def get(self, *args, **kwargs):
+        self.round_trip()
+        return super(LatencyCache, self).get(*args, **kwargs)
+
+    def get_many(self, keys, version=None):
+        self.round_trip()
+        return {
+            key: value for key, value in (
+                (key, super(LatencyCache, self).get(key, version=version))
+                for key in keys
+            )
+            if value is not None
+        }
+
+    def set(self, *args, **kwargs):
+        self.round_trip()
+        return super(LatencyCache, self).set(*args, **kwargs)
+
+    def set_many(self, data, timeout=None, version=None):
+        self.round_trip()
+        for key, value in data.items():
+            super(LatencyCache, self).set(key, value, timeout, version=version)
+        return []
+
+    def add(self, *args, **kwargs):
+        self.round_trip()
+        return super(LatencyCache, self).add(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        self.round_trip()
+        return super(LatencyCache, self).delete(*args, **kwargs)
@@ -0,0 +1,79 @@
+"""
+Compares latency of cache hits of `django.views.decorators.cache.cache_page`,
+`djangocache.cache_page` and the latter without single round trip lookup
+("old") against cache backend with simulated round trip time (1 ms)
+"""
+
+from __future__ import print_function
+
+import timeit
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.core.urlresolvers import ResolverMatch
+from django.test import RequestFactory
+from django.utils import decorators
+from django.views.decorators import cache as django_cache
+
+import benchmarks  # noqa: configures Django
+
+from djangocache import cache_page, CacheMiddleware
+
+LATENCY = 0.001
+
+NUMBER = 200
+
+settings.ALLOWED_HOSTS = ['*']
+settings.CACHES['latency'] = {
+    'BACKEND': 'benchmarks.backends.LatencyCache',
+    'OPTIONS': {'LATENCY': LATENCY},
+}
+
+
+class OldCacheMiddleware(CacheMiddleware):
+    """
+    Looks up the page without the headers list hint, i.e. the headers
+    list and the page are loaded by separate round trips as before
+    """
+
+    headerlist = property(lambda self: [], lambda self, value: None)
+
+
+def view(request):
+    response = HttpResponse(b'x' * 1024)
+    response['Vary'] = 'Accept-Encoding'
+    return response
+
+
+views = [
+    ('django', django_cache.cache_page(600, cache='latency', key_prefix='django')(view)),
+    ('djangocache (old)', decorators.decorator_from_middleware(lambda: OldCacheMiddleware(
+        cache_timeout=600,
+        cache_alias='latency',
+        key_prefix='old',
+    ))(view)),
+    ('djangocache', cache_page(cache_timeout=600, cache_alias='latency', key_prefix='djangocache')(view)),
+]
+
+
+def main():
+    factory = RequestFactory()
+    cache = caches['latency']
+    print('{:<18} {:>12} {:>12}'.format('view', 'hit, ms', 'round trips'))
+    for name, cached_view in views:
+        request = factory.get('/', HTTP_ACCEPT_ENCODING='gzip')
+        request.resolver_match = ResolverMatch(cached_view, (), {})
+        cached_view(request).close()  # fill the cache
+        cached_view(request).close()  # let the view learn headers list
+        cache.round_trips = 0
+        duration = timeit.timeit(lambda: cached_view(request).close(), number=NUMBER)
+        print('{:<18} {:>12.3f} {:>12.1f}'.format(
+            name,
+            duration / NUMBER * 1e3,
+            float(cache.round_trips) / NUMBER,
+        ))
+
+
+if __name__ == '__main__':
+    main()
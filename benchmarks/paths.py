@@ -0,0 +1,258 @@
+"""
+Measures latency percentiles and throughput of requests to views decorated
+by `django.views.decorators.cache.cache_page` and `djangocache.cache_page`
+for the main request paths: cold miss, warm hit, "304 Not Modified"
+by ETag and by Last-Modified, bypass of the cache forced by client
+(`Cache-Control: max-age=0`) and pages with heavy Vary.
+
+    python -m benchmarks.paths [--latency 0.001] [--json [FILE]] [--compare base.json]
+
+Results saved by `--json` can be compared later by `--compare`, both options
+can be used at once to compare with the previous results and save the new ones.
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import itertools
+import json
+import platform
+import sys
+
+from datetime import datetime
+from timeit import default_timer
+
+import django
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.urlresolvers import ResolverMatch
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.utils.cache import patch_vary_headers
+from django.views.decorators import cache as django_cache
+from django.views.decorators.http import condition
+
+import benchmarks  # noqa: configures Django
+
+import djangocache
+
+CACHE_ALIAS = 'benchmark'
+
+ETAG = '"0123456789abcdef"'
+
+# Sun, 17 Jul 2016 09:55:00 GMT
+LAST_MODIFIED = datetime.utcfromtimestamp(1468749300)
+
+VARY_HEADERS = ['Accept-Encoding', 'User-Agent', 'X-Device', 'X-Region']
+
+# number of distinct values of each Vary header
+VARY_VALUES = 3
+
+settings.ALLOWED_HOSTS = ['*']
+
+Result = collections.namedtuple(
+    'Result',
+    'implementation scenario status requests throughput mean p50 p90 p99',
+)
+
+
+def page(request):
+    return HttpResponse(b'x' * 16 * 1024, content_type='text/html; charset=utf-8')
+
+
+@condition(etag_func=lambda r: ETAG, last_modified_func=lambda r: LAST_MODIFIED)
+def conditional_page(request):
+    return page(request)
+
+
+def vary_page(request):
+    response = page(request)
+    patch_vary_headers(response, VARY_HEADERS)
+    return response
+
+
+def django_cache_page(view):
+    return django_cache.cache_page(600, cache=CACHE_ALIAS, key_prefix='django')(view)
+
+
+def djangocache_cache_page(view):
+    return djangocache.cache_page(cache_timeout=600, cache_alias=CACHE_ALIAS, key_prefix='djangocache')(view)
+
+
+implementations = collections.OrderedDict([
+    ('django', django_cache_page),
+    ('djangocache', djangocache_cache_page),
+])
+
+
+def vary_headers():
+    values = itertools.product(range(VARY_VALUES), repeat=len(VARY_HEADERS))
+    return [
+        {
+            'HTTP_' + header.upper().replace('-', '_'): 'value{}'.format(value)
+            for header, value in zip(VARY_HEADERS, combination)
+        }
+        for combination in values
+    ]
+
+
+def cold_miss(factory, number):
+    # every request asks for a new page
+    return page, [], [factory.get('/', {'page': n}) for n in range(number)]
+
+
+def warm_hit(factory, number):
+    request = factory.get('/')
+    return page, [request], [request] * number
+
+
+def not_modified_etag(factory, number):
+    request = factory.get('/', HTTP_IF_NONE_MATCH=ETAG)
+    return conditional_page, [factory.get('/')], [request] * number
+
+
+def not_modified_last_modified(factory, number):
+    request = factory.get('/', HTTP_IF_MODIFIED_SINCE='Sun, 17 Jul 2016 09:55:00 GMT')
+    return conditional_page, [factory.get('/')], [request] * number
+
+
+def bypass(factory, number):
+    request = factory.get('/', HTTP_CACHE_CONTROL='max-age=0')
+    return page, [factory.get('/')], [request] * number
+
+
+def vary_heavy(factory, number):
+    requests = [factory.get('/', **headers) for headers in vary_headers()]
+    return vary_page, requests, list(itertools.islice(itertools.cycle(requests), number))
+
+
+scenarios = collections.OrderedDict(
+    (scenario.__name__, scenario)
+    for scenario in (cold_miss, warm_hit, not_modified_etag, not_modified_last_modified, bypass, vary_heavy)
+)
+
+
+def call(view, request):
+    request.resolver_match = ResolverMatch(view, (), {})
+    response = view(request)
+    response.close()  # cache is updated on close
+    return response
+
+
+def percentile(durations, percent):
+    return durations[min(len(durations) - 1, int(len(durations) * percent / 100.0))]
+
+
+def run(implementation, scenario, number):
+    factory = RequestFactory()
+    caches[CACHE_ALIAS].clear()
+    view, warm_up_requests, requests = scenarios[scenario](factory, number)
+    view = implementations[implementation](view)
+    for request in warm_up_requests:
+        # fill the cache with the pages used by the scenario
+        call(view, request)
+    durations = []
+    statuses = collections.Counter()
+    started = default_timer()
+    for request in requests:
+        request_started = default_timer()
+        response = call(view, request)
+        durations.append(default_timer() - request_started)
+        statuses[response.status_code] += 1
+    total = default_timer() - started
+    durations.sort()
+    return Result(
+        implementation=implementation,
+        scenario=scenario,
+        status=statuses.most_common(1)[0][0],
+        requests=number,
+        throughput=number / total,
+        mean=sum(durations) / number * 1e3,
+        p50=percentile(durations, 50) * 1e3,
+        p90=percentile(durations, 90) * 1e3,
+        p99=percentile(durations, 99) * 1e3,
+    )
+
+
+def print_table(results, base=None):
+    print('{:<28} {:<12} {:>6} {:>10} {:>9} {:>9} {:>9}{}'.format(
+        'scenario', 'impl', 'status', 'req/s', 'p50, ms', 'p90, ms', 'p99, ms',
+        ' {:>9}'.format('p50 diff') if base else '',
+    ))
+    for result in results:
+        diff = ''
+        if base:
+            base_result = base.get((result.implementation, result.scenario))
+            if base_result:
+                diff = ' {:>+8.1f}%'.format((result.p50 / base_result['p50'] - 1) * 100)
+        print('{:<28} {:<12} {:>6} {:>10.0f} {:>9.3f} {:>9.3f} {:>9.3f}{}'.format(
+            result.scenario,
+            result.implementation,
+            result.status,
+            result.throughput,
+            result.p50,
+            result.p90,
+            result.p99,
+            diff,
+        ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--number', type=int, default=1000, help='requests per scenario')
+    parser.add_argument('--latency', type=float, default=0, help='simulated cache round trip time in seconds')
+    parser.add_argument('--scenario', action='append', choices=list(scenarios), help='scenarios to run')
+    parser.add_argument('--implementation', action='append', choices=list(implementations))
+    parser.add_argument(
+        '--json', metavar='FILE', nargs='?', const='-',
+        help='save machine-readable results to the file (or print them if no file is given)',
+    )
+    parser.add_argument('--compare', metavar='FILE', help='results (JSON) to compare with')
+    args = parser.parse_args(argv)
+
+    if args.latency:
+        settings.CACHES[CACHE_ALIAS] = {
+            'BACKEND': 'benchmarks.backends.LatencyCache',
+            'OPTIONS': {'LATENCY': args.latency},
+        }
+    else:
+        settings.CACHES[CACHE_ALIAS] = {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+
+    results = [
+        run(implementation, scenario, args.number)
+        for implementation in args.implementation or implementations
+        for scenario in args.scenario or scenarios
+    ]
+
+    base = None
+    if args.compare:
+        with open(args.compare) as compare_file:
+            base = {
+                (result['implementation'], result['scenario']): result
+                for result in json.load(compare_file)['results']
+            }
+
+    if args.json:
+        data = dict(
+            python=platform.python_version(),
+            django=django.get_version(),
+            backend=settings.CACHES[CACHE_ALIAS]['BACKEND'],
+            latency=args.latency,
+            results=[result._asdict() for result in results],
+        )
+        if args.json == '-':
+            json.dump(data, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json, 'w') as json_file:
+                json.dump(data, json_file, indent=2)
+    if args.json != '-':
+        print_table(results, base)
+
+
+if __name__ == '__main__':
+    main()
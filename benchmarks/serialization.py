@@ -0,0 +1,53 @@
+"""
+Compares payload size and decode time of pickled responses
+with compact records made by `djangocache.encode_response`,
+sizes are shown as overhead (in bytes) over the body size
+"""
+
+from __future__ import print_function
+
+import timeit
+
+from django.http import HttpResponse
+from django.utils.cache import patch_response_headers, patch_vary_headers
+from django.utils.six.moves import cPickle as pickle
+
+import benchmarks  # noqa: configures Django
+
+from djangocache import encode_response, decode_response
+
+BODY_SIZES = [0, 1024, 16 * 1024, 256 * 1024]
+
+NUMBER = 2000
+
+
+def make_response(body_size):
+    response = HttpResponse(b'x' * body_size, content_type='text/html; charset=utf-8')
+    response['ETag'] = '"0123456789abcdef"'
+    response['Last-Modified'] = 'Sun, 17 Jul 2016 09:55:00 GMT'
+    patch_vary_headers(response, ['Accept-Encoding', 'Cookie'])
+    patch_response_headers(response, 600)
+    return response
+
+
+def main():
+    print('{:>10} {:>10} {:>12} {:>10} {:>12}'.format(
+        'body, B', 'pickle, B', 'pickle, us', 'record, B', 'record, us',
+    ))
+    for body_size in BODY_SIZES:
+        response = make_response(body_size)
+        pickled = pickle.dumps(response, pickle.HIGHEST_PROTOCOL)
+        record = encode_response(response)
+        pickle_time = timeit.timeit(lambda: pickle.loads(pickled), number=NUMBER)
+        record_time = timeit.timeit(lambda: decode_response(record), number=NUMBER)
+        print('{:>10} {:>10} {:>12.2f} {:>10} {:>12.2f}'.format(
+            body_size,
+            len(pickled) - body_size,
+            pickle_time / NUMBER * 1e6,
+            len(record) - body_size,
+            record_time / NUMBER * 1e6,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,2165 @@
+import atexit
+import collections
+import copy
+import fnmatch
+import functools
+import hashlib
+import logging
+import math
+import random
+import re
+import socket
+import struct
+import threading
+import time
+import uuid
+import zlib
+
+from timeit import default_timer
+
+import django
+
+from django import db
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core import urlresolvers
+from django.core.handlers.base import BaseHandler
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.http import HttpResponse, SimpleCookie
+from django.middleware import cache as cache_middleware
+from django.utils import http, cache, decorators, six
+from django.utils.encoding import escape_uri_path, force_bytes
+from django.utils.module_loading import import_string
+from django.utils.text import compress_string
+from django.utils.translation import trans_real
+from django.utils.six.moves import cPickle as pickle
+from django.utils.six.moves.urllib.parse import urlsplit
+
+try:
+    from django.utils.deprecation import MiddlewareMixin
+except ImportError:  # pragma: no cover
+    MiddlewareMixin = object  # Django < 1.10
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:  # pragma: no cover
+    lz4 = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+__all__ = ['cache_page', 'invalidate_namespace', 'purge']
+
+logger = logging.getLogger('djangocache')
+
+# https://tools.ietf.org/html/rfc7232#section-4.1
+rfc7232_headers = ['ETag', 'Vary', 'Cache-Control', 'Expires', 'Content-Location', 'Date', 'Last-Modified']
+
+RECORD_VERSION = 3
+
+# version, codec, status code, regeneration time (seconds), size of headers block
+record_header = struct.Struct('!BBHfI')
+
+# version, codec, status code, size of headers block
+record_header_v2 = struct.Struct('!BBHI')
+
+# version, status code, size of headers block
+record_header_v1 = struct.Struct('!BHI')
+
+# `errors` are raised by `decompress` on corrupted data
+Codec = collections.namedtuple('Codec', 'id name compress decompress errors')
+
+IDENTITY = 0
+
+codecs = [Codec(1, 'zlib', zlib.compress, zlib.decompress, zlib.error)]
+if lz4 is not None:  # pragma: no cover
+    codecs.append(Codec(3, 'lz4', lz4.frame.compress, lz4.frame.decompress, RuntimeError))
+if zstandard is not None:  # pragma: no cover
+    codecs.append(Codec(
+        2,
+        'zstd',
+        lambda data: zstandard.ZstdCompressor().compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data),
+        zstandard.ZstdError,
+    ))
+codecs = collections.OrderedDict((codec.id, codec) for codec in reversed(codecs))
+
+
+def get_codec(compress):
+    """
+    Returns codec by its name, the best available one if `compress` is True
+    """
+    if not compress:
+        return None
+    for codec in codecs.values():
+        if compress is True or codec.name == compress:
+            return codec
+    raise ImproperlyConfigured('Compression codec {!r} is not available'.format(compress))
+
+
+class CompressionStats(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.compressed = self.skipped = self.decompressed = 0
+            self.raw_bytes = self.compressed_bytes = 0
+            self.compress_time = self.decompress_time = 0.0
+
+    def record_compression(self, raw_size, compressed_size, duration):
+        with self.lock:
+            if compressed_size is None:
+                self.skipped += 1
+                return
+            self.compressed += 1
+            self.raw_bytes += raw_size
+            self.compressed_bytes += compressed_size
+            self.compress_time += duration
+
+    def record_decompression(self, duration):
+        with self.lock:
+            self.decompressed += 1
+            self.decompress_time += duration
+
+    @property
+    def ratio(self):
+        if not self.compressed_bytes:
+            return None
+        return float(self.raw_bytes) / self.compressed_bytes
+
+    def stats(self):
+        return dict(
+            compressed=self.compressed,
+            skipped=self.skipped,
+            decompressed=self.decompressed,
+            raw_bytes=self.raw_bytes,
+            compressed_bytes=self.compressed_bytes,
+            ratio=self.ratio,
+            compress_time=self.compress_time,
+            decompress_time=self.decompress_time,
+        )
+
+
+compression_stats = CompressionStats()
+
+# content encoders in order of preference
+content_encoders = collections.OrderedDict()
+if brotli is not None:  # pragma: no cover
+    content_encoders['br'] = brotli.compress
+content_encoders['gzip'] = compress_string
+
+
+class CacheEvent(object):
+    """
+    Outcome of the cache lookup or update: `hit`, `not_modified` (hit answered
+    by "304 Not Modified"), `stale` (stale page is served), `bypass` (client
+    asked to skip the cache), `bypass_throttled` (cached page is served
+    despite client asked to skip the cache), `early_expiration` (page
+    is regenerated before it expires), `miss`, `write` or `not_admitted`
+    (page is not requested often enough to be cached); timings are in seconds
+    """
+
+    __slots__ = ('name', 'view', 'key_prefix', 'age', 'size', 'lookup_time', 'write_time')
+
+    def __init__(self, name, view, key_prefix, age=None, size=None, lookup_time=None, write_time=None):
+        self.name = name
+        self.view = view
+        self.key_prefix = key_prefix
+        self.age = age
+        self.size = size
+        self.lookup_time = lookup_time
+        self.write_time = write_time
+
+    def as_dict(self):
+        return {attr: getattr(self, attr) for attr in self.__slots__}
+
+
+class StatsSink(object):
+    """
+    Base class of receivers of cache events, see `DJANGOCACHE_STATS_SINKS`
+    """
+
+    def emit(self, event):
+        raise NotImplementedError
+
+
+class MemoryStatsSink(StatsSink):
+    """
+    Keeps per view counters of events and total timings in memory
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def emit(self, event):
+        with self.lock:
+            stats = self.views.get(event.view)
+            if stats is None:
+                stats = self.views[event.view] = collections.defaultdict(int)
+            stats[event.name] += 1
+            if event.size is not None:
+                stats[event.name + '_size'] += event.size
+            if event.lookup_time is not None:
+                stats['lookup_time'] += event.lookup_time
+            if event.write_time is not None:
+                stats['write_time'] += event.write_time
+
+    def hit_ratio(self, view):
+        stats = self.views.get(view, {})
+        hits = sum(stats.get(event, 0) for event in ('hit', 'not_modified', 'stale', 'bypass_throttled'))
+        total = hits + sum(stats.get(event, 0) for event in ('miss', 'bypass', 'early_expiration'))
+        if not total:
+            return None
+        return float(hits) / total
+
+    def stats(self):
+        with self.lock:
+            return {view: dict(stats) for view, stats in self.views.items()}
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+
+
+class LoggingStatsSink(StatsSink):
+    """
+    Logs every event using `djangocache.events` logger (by default)
+    """
+
+    def __init__(self, logger='djangocache.events', level=logging.INFO):
+        self.logger = logging.getLogger(logger)
+        self.level = level
+
+    def emit(self, event):
+        self.logger.log(
+            self.level,
+            'cache %s: view=%s key_prefix=%s age=%s size=%s lookup_time=%s write_time=%s',
+            event.name,
+            event.view,
+            event.key_prefix,
+            event.age,
+            event.size,
+            event.lookup_time,
+            event.write_time,
+            extra={'cache_event': event.as_dict()},
+        )
+
+
+class StatsdStatsSink(StatsSink):
+    """
+    Sends events to statsd by UDP: `<prefix>.<view>.<event>` counters,
+    `<prefix>.<view>.lookup_time`/`write_time` timers (ms)
+    and `<prefix>.<view>.size`/`age` histograms
+    """
+
+    def __init__(self, host='localhost', port=8125, prefix='djangocache'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    @staticmethod
+    def clean(name):
+        return re.sub(r'[^\w.-]', '_', name)
+
+    def emit(self, event):
+        prefix = '{}.{}'.format(self.prefix, self.clean(event.view))
+        metrics = ['{}.{}:1|c'.format(prefix, event.name)]
+        if event.lookup_time is not None:
+            metrics.append('{}.lookup_time:{:.3f}|ms'.format(prefix, event.lookup_time * 1000))
+        if event.write_time is not None:
+            metrics.append('{}.write_time:{:.3f}|ms'.format(prefix, event.write_time * 1000))
+        if event.size is not None:
+            metrics.append('{}.size:{}|h'.format(prefix, event.size))
+        if event.age is not None:
+            metrics.append('{}.age:{}|h'.format(prefix, event.age))
+        try:
+            self.socket.sendto('\n'.join(metrics).encode('ascii'), self.address)
+        except socket.error:
+            pass  # stats are not worth failing the request
+
+
+_stats_sinks = (None, [])
+
+
+def get_stats_sinks():
+    """
+    Returns sinks configured by `DJANGOCACHE_STATS_SINKS`: list of dicts
+    with `BACKEND` (import path of `StatsSink` subclass) and `OPTIONS`
+    """
+    global _stats_sinks
+    config, sinks = _stats_sinks
+    current_config = getattr(settings, 'DJANGOCACHE_STATS_SINKS', None)
+    if current_config is not config:
+        sinks = [
+            import_string(sink['BACKEND'])(**sink.get('OPTIONS', {}))
+            for sink in current_config or []
+        ]
+        _stats_sinks = current_config, sinks
+    return sinks
+
+
+def emit_event(name, request, **kwargs):
+    sinks = get_stats_sinks()
+    if not sinks:
+        return
+    event = CacheEvent(
+        name,
+        view=request.resolver_match.view_name,
+        key_prefix=getattr(request, '_cache_key_prefix', None),
+        **kwargs
+    )
+    for sink in sinks:
+        try:
+            sink.emit(event)
+        except Exception:
+            logger.exception('Failed to emit cache event to %r', sink)
+
+
+def get_server_timing(outcome, timing):
+    """
+    Returns value of `Server-Timing` header, durations are in ms
+    """
+    metrics = ['cache;desc="{}"'.format(outcome)]
+    for phase in ('lookup', 'decode', 'conditional', 'view'):
+        if phase in timing:
+            metrics.append('{};dur={:.3f}'.format(phase, timing[phase] * 1000))
+    return ', '.join(metrics)
+
+
+def cache_page(**kwargs):
+    """
+    This decorator is similar to `django.views.decorators.cache.cache_page`
+    """
+    cache_timeout = kwargs.pop('cache_timeout', None)
+    key_prefix = kwargs.pop('key_prefix', None)
+    cache_min_age = kwargs.pop('cache_min_age', None)
+    middleware = CacheMiddleware(
+        cache_timeout=cache_timeout,
+        key_prefix=key_prefix,
+        cache_min_age=cache_min_age,
+        **kwargs
+    )
+    decorator = decorators.decorator_from_middleware(lambda: middleware)
+
+    def cached_view(view):
+        view = decorator(view)
+        view.djangocache_cached = True  # used to find cached views
+        if middleware.early:
+            registry[view] = middleware
+        return view
+    return cached_view
+
+
+# middleware of the views served by EarlyCacheMiddleware
+registry = {}
+
+
+class EarlyCacheMiddleware(MiddlewareMixin):
+    """
+    Site-wide middleware serving cached pages of views decorated
+    by `cache_page(early=True)` before the rest of middleware
+    and the URL resolution, must be the first one
+    """
+
+    # max number of remembered results of URL resolution
+    MAX_MATCHES = 10000
+
+    LOCALE_MIDDLEWARE = 'django.middleware.locale.LocaleMiddleware'
+
+    def __init__(self, *args, **kwargs):
+        super(EarlyCacheMiddleware, self).__init__(*args, **kwargs)
+        self.matches = {}
+        self.locale_middleware = None
+        middleware = getattr(settings, 'MIDDLEWARE', None)
+        if middleware is None:
+            middleware = settings.MIDDLEWARE_CLASSES
+        if settings.USE_I18N and self.LOCALE_MIDDLEWARE in middleware:
+            self.locale_middleware = import_string(self.LOCALE_MIDDLEWARE)()
+
+    def resolve(self, path):
+        try:
+            return self.matches[path]
+        except KeyError:
+            pass
+        try:
+            match = urlresolvers.resolve(path)
+        except urlresolvers.Resolver404:
+            match = None
+        if len(self.matches) >= self.MAX_MATCHES:
+            self.matches.clear()
+        self.matches[path] = match
+        return match
+
+    def process_request(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        # the language of cache keys is set as `LocaleMiddleware` does,
+        # the active one is left by the previous request of the thread
+        # (it is used by resolution of language prefixed URL patterns too)
+        if self.locale_middleware is not None:
+            self.locale_middleware.process_request(request)
+        match = self.resolve(request.path_info)
+        middleware = match and registry.get(match.func)
+        if middleware is None:
+            return None
+        if self.locale_middleware is None and (settings.USE_I18N or settings.USE_L10N):
+            request.LANGUAGE_CODE = settings.LANGUAGE_CODE
+        request.resolver_match = match
+        return middleware.process_request(request, early=True)
+
+
+def is_cacheable(request, response):
+    if response.streaming or response.status_code != 200:
+        return False
+
+    # Don't cache responses that set a user-specific (and maybe security
+    # sensitive) cookie in response to a cookie-less request.
+    # With selected cookies (see `cache_page(cookies=...)`) the request
+    # is cookie-less if it has none of them.
+    key_request = getattr(request, '_cache_key_request', request)
+    if key_request.META is request.META:
+        has_cookies = bool(request.COOKIES)
+    else:
+        has_cookies = bool(key_request.META.get('HTTP_COOKIE'))
+    if not has_cookies and response.cookies and cache.has_vary_header(response, 'Cookie'):
+        return False
+
+    return True
+
+
+def get_cache_max_age(cache_control):
+    if not cache_control:
+        return
+    cache_control_kwargs = dict(
+        cache._to_tuple(attr)
+        for attr in
+        cache.cc_delim_re.split(cache_control)
+    )
+    if 'max-age' in cache_control_kwargs:
+        try:
+            return int(cache_control_kwargs['max-age'])
+        except (ValueError, TypeError):
+            pass
+
+
+def get_conditional_response(request, response=None):
+    if not (response and hasattr(cache, 'get_conditional_response')):
+        # Django 1.8 does not have such method, can't do anything
+        return response
+    last_modified = response.get('Last-Modified')
+    etag = response.get('ETag')
+    if etag and django.VERSION < (1, 11):
+        # Django<1.11 compares unquoted ETags
+        etag = http.unquote_etag(etag)
+    conditional_response = cache.get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=http.parse_http_date_safe(last_modified),
+        response=response,
+    )
+    if conditional_response is response:
+        return response
+    headers = {
+        header: response[header]
+        for header in rfc7232_headers
+        if header in response
+    }
+    for header, value in headers.items():
+        conditional_response[header] = value
+    return conditional_response
+
+
+def encode_response(response, codec=None, min_size=0, regeneration_time=None):
+    """
+    Packs response into compact record: version, codec, status code,
+    time spent on the page generation, flat headers list and body,
+    the latter is compressed by `codec` if its size is not less than `min_size`
+    """
+    if response.cookies:
+        # cookies can't be represented by flat headers list, fallback to pickle
+        if 'wsgi_request' in response.__dict__:
+            # request is attached by the test client, it must not be shared
+            response = copy.copy(response)
+            del response.wsgi_request
+        response._cache_regeneration_time = regeneration_time
+        return response
+    headers = force_bytes(
+        '\n'.join(
+            '%s\n%s\n%s' % (key, header, value)
+            for key, (header, value) in response._headers.items()
+        ),
+        'latin-1',
+    )
+    body = response.content
+    codec_id = IDENTITY
+    if codec is not None and len(body) >= min_size:
+        started = default_timer()
+        compressed = codec.compress(body)
+        duration = default_timer() - started
+        if len(compressed) < len(body):
+            compression_stats.record_compression(len(body), len(compressed), duration)
+            codec_id, body = codec.id, compressed
+        else:
+            compression_stats.record_compression(len(body), None, duration)
+    header = record_header.pack(
+        RECORD_VERSION,
+        codec_id,
+        response.status_code,
+        regeneration_time or 0,
+        len(headers),
+    )
+    return header + headers + body
+
+
+def decode_response(record):
+    """
+    Builds response from record made by `encode_response`,
+    returns None if record has unknown format
+    """
+    if not isinstance(record, six.binary_type):
+        # pickled response
+        return record
+    try:
+        version = six.indexbytes(record, 0)
+        regeneration_time = None
+        if version == RECORD_VERSION:
+            _, codec_id, status_code, regeneration_time, headers_size = record_header.unpack_from(record)
+            headers_offset = record_header.size
+        elif version == 2:
+            _, codec_id, status_code, headers_size = record_header_v2.unpack_from(record)
+            headers_offset = record_header_v2.size
+        elif version == 1:
+            _, status_code, headers_size = record_header_v1.unpack_from(record)
+            codec_id, headers_offset = IDENTITY, record_header_v1.size
+        else:
+            return None
+    except (IndexError, struct.error):
+        return None
+    body_offset = headers_offset + headers_size
+    body = record[body_offset:]
+    if codec_id != IDENTITY:
+        if codec_id not in codecs:
+            # compressed by codec which is not installed
+            return None
+        codec = codecs[codec_id]
+        started = default_timer()
+        try:
+            body = codec.decompress(body)
+        except codec.errors:
+            # corrupted or truncated record
+            return None
+        compression_stats.record_decompression(default_timer() - started)
+    headers = record[headers_offset:body_offset]
+    if six.PY3:
+        headers = headers.decode('latin-1')
+    headers = headers.split('\n') if headers else []
+    headers = dict(zip(headers[0::3], zip(headers[1::3], headers[2::3])))
+    response = build_response(status_code, headers, body)
+    response._cache_regeneration_time = regeneration_time or None
+    return response
+
+
+_response_state = None
+
+
+def build_response(status_code, headers, content):
+    """
+    Fast equivalent of `HttpResponse(content, status=status_code)`
+    with headers replaced by the provided ones
+    """
+    global _response_state
+    if status_code != 200:
+        response = HttpResponse(content, status=status_code)
+        response._headers = headers
+        return response
+    if _response_state is None:
+        _response_state = HttpResponse().__dict__.copy()
+    response = HttpResponse.__new__(HttpResponse)
+    response.__dict__.update(_response_state)
+    response.__dict__.update(
+        _headers=headers,
+        _closable_objects=[],
+        _container=[content],
+        cookies=SimpleCookie(),
+    )
+    return response
+
+
+def precompress_response(response):
+    """
+    Returns identity version of the response and its variants
+    encoded by all available content encoders
+    """
+    content_encoding = response.get('Content-Encoding')
+    if content_encoding == 'gzip':
+        # already compressed by GZipMiddleware
+        content = zlib.decompress(response.content, 16 + zlib.MAX_WBITS)
+    elif content_encoding or response.cookies:
+        return {None: response}
+    else:
+        content = response.content
+    headers = dict(response._headers)
+    headers.pop('content-encoding', None)
+    identity = build_response(response.status_code, headers, content)
+    cache.patch_vary_headers(identity, ['Accept-Encoding'])
+    if identity.has_header('Content-Length'):
+        identity['Content-Length'] = str(len(content))
+    variants = {None: identity}
+    for encoding, encode in content_encoders.items():
+        variant = build_response(
+            response.status_code,
+            dict(identity._headers),
+            encode(content),
+        )
+        variant['Content-Encoding'] = encoding
+        if variant.has_header('Content-Length'):
+            variant['Content-Length'] = str(len(variant.content))
+        etag = variant.get('ETag')
+        if etag and etag.startswith('"'):
+            # body is changed, so ETag can't be strong anymore
+            variant['ETag'] = 'W/' + etag
+        variants[encoding] = variant
+    return variants
+
+
+class NameFilter(object):
+    """
+    Filters names (of query parameters, cookies, etc.) by `allow`
+    and `deny` lists, wildcards like `utm_*` are supported
+    """
+
+    def __init__(self, allow=None, deny=None):
+        self.allow_re = self.compile(allow)
+        self.deny_re = self.compile(deny)
+
+    @staticmethod
+    def compile(patterns):
+        if patterns is None:
+            return None
+        if isinstance(patterns, six.string_types):
+            patterns = [patterns]
+        return re.compile('|'.join(fnmatch.translate(pattern) for pattern in patterns) or '(?!)')
+
+    def is_allowed(self, name):
+        if self.allow_re is not None and not self.allow_re.match(name):
+            return False
+        return self.deny_re is None or not self.deny_re.match(name)
+
+
+class QueryParams(NameFilter):
+    """
+    Policy building canonical query string of the page URL: parameters
+    are filtered and sorted by name
+    """
+
+    def get_query_string(self, request):
+        params = [
+            (name, values)
+            for name, values in request.GET.lists()
+            if self.is_allowed(name)
+        ]
+        # order of values of the same parameter is kept
+        params.sort(key=lambda param: param[0])
+        return http.urlencode(params, doseq=True)
+
+
+class Cookies(NameFilter):
+    """
+    Policy building Cookie header of the cache key from filtered cookies
+    """
+
+    def get_cookie(self, request):
+        return '; '.join(
+            '{}={}'.format(name, value)
+            for name, value in sorted(request.COOKIES.items())
+            if self.is_allowed(name)
+        )
+
+
+def get_query_params(query_params):
+    """
+    Returns QueryParams by `cache_page` param: True (sorted parameters),
+    False (ignore query string), dict with `allow` and/or `deny` lists
+    or None (query string is used as is)
+    """
+    if query_params is None or isinstance(query_params, QueryParams):
+        return query_params
+    if query_params is True:
+        return QueryParams()
+    if query_params is False:
+        return QueryParams(allow=[])
+    if isinstance(query_params, dict):
+        return QueryParams(**query_params)
+    raise ImproperlyConfigured('Invalid query_params: {!r}'.format(query_params))
+
+
+def parse_accept_header(value):
+    """
+    Returns dict of values of Accept-* header and their qualities,
+    values with invalid quality are omitted
+    """
+    qualities = {}
+    for item in value.split(','):
+        params = item.split(';')
+        name = params[0].strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params[1:]:
+            param_name, _, param_value = param.partition('=')
+            if param_name.strip().lower() == 'q':
+                try:
+                    quality = float(param_value)
+                except ValueError:
+                    quality = None
+                break
+        if quality is not None:
+            qualities[name] = quality
+    return qualities
+
+
+def get_accepted(value, supported):
+    """
+    Returns supported values (in the same order) acceptable according
+    to Accept-* header, the ones refused explicitly (q=0) are not
+    matched by `*`
+    """
+    qualities = parse_accept_header(value)
+    default = qualities.get('*', 0)
+    return [item for item in supported if qualities.get(item, default) > 0]
+
+
+def normalize_accept_encoding(value):
+    """
+    Reduces Accept-Encoding to supported encodings:
+    'br, gzip', 'br', 'gzip' or 'identity'
+    """
+    return ', '.join(get_accepted(value, ('br', 'gzip'))) or 'identity'
+
+
+def normalize_accept_language(value):
+    """
+    Reduces Accept-Language to the best match among `settings.LANGUAGES`,
+    `settings.LANGUAGE_CODE` if there is no such one
+    """
+    for language, _ in trans_real.parse_accept_lang_header(value):
+        if language == '*':
+            break
+        try:
+            return trans_real.get_supported_language_variant(language)
+        except LookupError:
+            continue
+    return settings.LANGUAGE_CODE
+
+
+bot_re = re.compile(r'bot|crawl|spider|slurp|facebookexternalhit|preview|curl|wget|python', re.IGNORECASE)
+mobile_re = re.compile(r'mobi|android|iphone|ipod|ipad|windows phone|opera mini|blackberry', re.IGNORECASE)
+
+
+def normalize_user_agent(value):
+    """
+    Reduces User-Agent to 'bot', 'mobile' or 'desktop'
+    """
+    if bot_re.search(value):
+        return 'bot'
+    if mobile_re.search(value):
+        return 'mobile'
+    return 'desktop'
+
+
+def get_vary_normalizers(vary_normalizers):
+    """
+    Returns list of (META key, normalizer) by dict of header names
+    and normalizers (callables or their import paths)
+    """
+    normalizers = []
+    for header, normalizer in vary_normalizers.items():
+        meta_key = header.upper().replace('-', '_')
+        if meta_key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            # cache keys are made only of HTTP_* headers
+            raise ImproperlyConfigured('{} header can not be normalized'.format(header))
+        if isinstance(normalizer, six.string_types):
+            normalizer = import_string(normalizer)
+        normalizers.append(('HTTP_' + meta_key, normalizer))
+    return normalizers
+
+
+def get_cookies(cookies):
+    """
+    Returns Cookies by `cache_page` param: list of allowed cookies,
+    dict with `allow` and/or `deny` lists or None (Cookie header
+    is used as is)
+    """
+    if cookies is None or isinstance(cookies, Cookies):
+        return cookies
+    if isinstance(cookies, (list, tuple)):
+        return Cookies(allow=cookies)
+    if isinstance(cookies, dict):
+        return Cookies(**cookies)
+    raise ImproperlyConfigured('Invalid cookies: {!r}'.format(cookies))
+
+
+class CacheKeyRequest(object):
+    """
+    Proxy of the request used to generate cache keys, its URL
+    has canonical `query_string` and its Cookie header has only
+    selected cookies (if any of them is not None), the view gets
+    the original request
+    """
+
+    def __init__(self, request, query_string=None, cookie=None):
+        self.request = request
+        self.absolute_uri = None
+        if query_string is not None:
+            location = '//' + escape_uri_path(request.path)
+            if query_string:
+                location += '?' + query_string
+            self.absolute_uri = request.build_absolute_uri(location)
+        if cookie is not None:
+            self.META = dict(request.META, HTTP_COOKIE=cookie)
+
+    def __getattr__(self, item):
+        if item == 'request':
+            # not initialized yet, e.g. by copy or pickle
+            raise AttributeError(item)
+        return getattr(self.request, item)
+
+    def build_absolute_uri(self, location=None):
+        if location is None and self.absolute_uri is not None:
+            return self.absolute_uri
+        return self.request.build_absolute_uri(location)
+
+
+def get_cache_key(request, method, headerlist, key_prefix):
+    key_request = getattr(request, '_cache_key_request', request)
+    return cache._generate_cache_key(key_request, method, headerlist, key_prefix)
+
+
+def get_cache_header_key(key_prefix, request):
+    key_request = getattr(request, '_cache_key_request', request)
+    return cache._generate_cache_header_key(key_prefix, key_request)
+
+
+def get_headerlist(response, ignore_headers=()):
+    """
+    Returns list of headers (in WSGI format) from the Vary header
+    used to generate cache key, see `django.utils.cache.learn_cache_key`
+    """
+    headerlist = []
+    if response.has_header('Vary'):
+        is_accept_language_redundant = settings.USE_I18N or settings.USE_L10N
+        for header in cache.cc_delim_re.split(response['Vary']):
+            header = 'HTTP_' + header.upper().replace('-', '_')
+            if header == 'HTTP_ACCEPT_LANGUAGE' and is_accept_language_redundant:
+                continue
+            if header not in ignore_headers:
+                headerlist.append(header)
+        headerlist.sort()
+    return headerlist
+
+
+def get_validators_key(request, headerlist, key_prefix):
+    """
+    Returns key of validators record which is shared by all conditional
+    variants of the page
+    """
+    headerlist = [
+        header for header in headerlist
+        if header not in CacheMiddleware.CONDITIONAL_VARY_HEADERS
+    ]
+    return get_cache_key(request, 'GET', headerlist, key_prefix) + '.validators'
+
+
+class RefreshExecutor(object):
+    """
+    Bounded pool of background threads regenerating stale pages,
+    guarantees only one refresh per key is in flight
+    """
+
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.queue = six.moves.queue.Queue(queue_size)
+        self.pending = set()
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def submit(self, key, func, *args):
+        with self.lock:
+            if key in self.pending:
+                return False
+            try:
+                self.queue.put_nowait((key, func, args))
+            except six.moves.queue.Full:
+                return False
+            self.pending.add(key)
+            if len(self.threads) < self.workers:
+                thread = threading.Thread(target=self.work, name='djangocache-refresh')
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+        return True
+
+    def work(self):
+        while True:
+            key, func, args = self.queue.get()
+            try:
+                func(*args)
+            except Exception:
+                logger.exception('Failed to refresh %s', key)
+            finally:
+                with self.lock:
+                    self.pending.discard(key)
+                self.queue.task_done()
+
+
+_refresh_executor = None
+_refresh_executor_lock = threading.Lock()
+
+
+def get_refresh_executor():
+    global _refresh_executor
+    with _refresh_executor_lock:
+        if _refresh_executor is None:
+            _refresh_executor = RefreshExecutor(
+                workers=getattr(settings, 'DJANGOCACHE_REFRESH_WORKERS', 2),
+                queue_size=getattr(settings, 'DJANGOCACHE_REFRESH_QUEUE_SIZE', 100),
+            )
+        return _refresh_executor
+
+
+class WriteBehindQueue(object):
+    """
+    Bounded queue of cache writes flushed by background thread
+    in `set_many` batches, the oldest writes are dropped when the queue is full
+    """
+
+    def __init__(self, max_size, batch_size):
+        self.writes = collections.deque()
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.thread = None
+        self.dropped = self.written = self.flushes = 0
+        self.flush_time = self.last_flush_time = 0.0
+
+    def put(self, cache, records, timeout, callback=None):
+        """
+        Schedules `cache.set_many(records, timeout)`, `callback` is called
+        with duration of `set_many` after the write, or with None
+        if the write was dropped or failed
+        """
+        dropped = None
+        with self.condition:
+            if len(self.writes) >= self.max_size:
+                dropped = self.writes.popleft()
+                self.dropped += 1
+            self.writes.append((cache, records, timeout, callback))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.work, name='djangocache-write-behind')
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify()
+        if dropped is not None:
+            logger.warning('Write-behind queue is full, dropped %d records', len(dropped[1]))
+            self.run_callbacks([dropped])
+
+    def work(self):
+        while True:
+            with self.condition:
+                while not self.writes:
+                    self.condition.wait()
+            self.flush()
+
+    def flush(self):
+        """
+        Writes all queued records, blocks until they are written
+        """
+        with self.flush_lock:
+            while True:
+                with self.condition:
+                    batch = [
+                        self.writes.popleft()
+                        for _ in range(min(self.batch_size, len(self.writes)))
+                    ]
+                if not batch:
+                    return
+                self.write(batch)
+
+    def write(self, batch):
+        started = default_timer()
+        batches = collections.OrderedDict()
+        for target_cache, records, timeout, callback in batch:
+            # later writes override earlier ones with the same keys
+            batches.setdefault((target_cache, timeout), {}).update(records)
+        written = 0
+        write_times = {}
+        for (target_cache, timeout), records in batches.items():
+            write_started = default_timer()
+            try:
+                target_cache.set_many(records, timeout)
+            except Exception:
+                logger.exception('Failed to write %d records to cache', len(records))
+            else:
+                write_times[target_cache, timeout] = default_timer() - write_started
+                written += len(records)
+        duration = default_timer() - started
+        with self.condition:
+            self.written += written
+            self.flushes += 1
+            self.flush_time += duration
+            self.last_flush_time = duration
+        self.run_callbacks(batch, write_times)
+
+    @staticmethod
+    def run_callbacks(batch, write_times=None):
+        for target_cache, records, timeout, callback in batch:
+            if callback is None:
+                continue
+            try:
+                callback((write_times or {}).get((target_cache, timeout)))
+            except Exception:
+                logger.exception('Write-behind callback failed')
+
+    @property
+    def depth(self):
+        return len(self.writes)
+
+    def stats(self):
+        return dict(
+            depth=self.depth,
+            dropped=self.dropped,
+            written=self.written,
+            flushes=self.flushes,
+            flush_time=self.flush_time,
+            last_flush_time=self.last_flush_time,
+        )
+
+
+_write_behind_queue = None
+_write_behind_queue_lock = threading.Lock()
+
+
+def get_write_behind_queue():
+    global _write_behind_queue
+    with _write_behind_queue_lock:
+        if _write_behind_queue is None:
+            _write_behind_queue = WriteBehindQueue(
+                max_size=getattr(settings, 'DJANGOCACHE_WRITE_BEHIND_QUEUE_SIZE', 1000),
+                batch_size=getattr(settings, 'DJANGOCACHE_WRITE_BEHIND_BATCH_SIZE', 100),
+            )
+            # don't lose pending writes on shutdown
+            atexit.register(_write_behind_queue.flush)
+        return _write_behind_queue
+
+
+class CountMinSketch(object):
+    """
+    Approximate frequencies of keys in `depth` rows of `width` 4-bit
+    counters (one byte each), all counters are halved after every
+    `sample_size` additions, so the history is aging (TinyLFU)
+    """
+
+    MAX_COUNT = 15
+
+    def __init__(self, width=16384, depth=4, sample_size=None):
+        self.width = width
+        self.depth = depth
+        self.sample_size = sample_size or 10 * width
+        self.table = bytearray(width * depth)
+        self.additions = 0
+        self.resets = 0
+        # counters are updated without lock, lost increments
+        # don't matter for the estimate
+        self.reset_lock = threading.Lock()
+
+    def get_indexes(self, key):
+        # double hashing, one hash of the key for all rows
+        key_hash = hash(key)
+        step = (key_hash >> 16) | 1
+        width = self.width
+        return [row * width + (key_hash + row * step) % width for row in range(self.depth)]
+
+    def add(self, key):
+        """
+        Counts the key, returns its new estimated frequency
+        """
+        table = self.table
+        estimate = self.MAX_COUNT
+        for index in self.get_indexes(key):
+            count = table[index]
+            if count < self.MAX_COUNT:
+                table[index] = count = count + 1
+            if count < estimate:
+                estimate = count
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.reset()
+        return estimate
+
+    def estimate(self, key):
+        table = self.table
+        return min([table[index] for index in self.get_indexes(key)])
+
+    def reset(self):
+        with self.reset_lock:
+            if self.additions < self.sample_size:
+                return  # already reset by another thread
+            self.additions //= 2
+            self.table[:] = bytearray(count >> 1 for count in self.table)
+            self.resets += 1
+
+    def stats(self):
+        return dict(
+            width=self.width,
+            depth=self.depth,
+            additions=self.additions,
+            resets=self.resets,
+        )
+
+
+def create_sketch():
+    admission_settings = getattr(settings, 'DJANGOCACHE_ADMISSION', {})
+    return CountMinSketch(
+        width=admission_settings.get('WIDTH', 16384),
+        depth=admission_settings.get('DEPTH', 4),
+        sample_size=admission_settings.get('SAMPLE_SIZE'),
+    )
+
+
+_admission_sketch = None
+_admission_sketch_lock = threading.Lock()
+
+
+def get_admission_sketch():
+    """
+    Returns frequencies of cache misses shared by all views of the process
+    """
+    global _admission_sketch
+    with _admission_sketch_lock:
+        if _admission_sketch is None:
+            _admission_sketch = create_sketch()
+        return _admission_sketch
+
+
+class LocalCache(object):
+    """
+    Per-process LRU cache limited by total size of pickled values (in bytes),
+    entries live not longer than `ttl` seconds. With `sketch` of accesses
+    new entry is admitted only if it is more frequent than the entry
+    it would evict (TinyLFU)
+    """
+
+    def __init__(self, max_size, ttl, sketch=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sketch = sketch
+        self.size = 0
+        self.hits = self.misses = self.evictions = self.rejections = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        if self.sketch is not None:
+            self.sketch.add(key)
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                expires, data = entry
+                if expires > time.time():
+                    self.entries[key] = entry  # move to the end
+                    self.hits += 1
+                else:
+                    self.size -= len(data)
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+        return pickle.loads(data)
+
+    def set(self, key, value, timeout=None):
+        ttl = self.ttl if timeout is None else min(self.ttl, timeout)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self._delete(key)
+            if ttl <= 0 or len(data) > self.max_size:
+                return
+            if self.sketch is not None and self.size + len(data) > self.max_size:
+                victim = next(iter(self.entries))
+                if self.sketch.estimate(key) <= self.sketch.estimate(victim):
+                    self.rejections += 1
+                    return
+            self.entries[key] = time.time() + ttl, data
+            self.size += len(data)
+            while self.size > self.max_size:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self.lock:
+            self._delete(key)
+
+    def _delete(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            rejections=self.rejections,
+            size=self.size,
+            entries=len(self.entries),
+        )
+
+
+local_caches = {}
+_local_caches_lock = threading.Lock()
+
+
+def get_local_cache(cache_alias, max_size=None, ttl=None):
+    """
+    Returns LocalCache shared by all views with the same L1 settings,
+    None if L1 is disabled
+    """
+    l1_settings = getattr(settings, 'DJANGOCACHE_L1', {})
+    if max_size is None:
+        max_size = l1_settings.get('SIZE')
+    if ttl is None:
+        ttl = l1_settings.get('TTL', 5)
+    if not max_size or not ttl:
+        return None
+    with _local_caches_lock:
+        key = cache_alias, max_size, ttl
+        if key not in local_caches:
+            local_caches[key] = LocalCache(
+                max_size=max_size,
+                ttl=ttl,
+                sketch=create_sketch() if l1_settings.get('ADMISSION') else None,
+            )
+        return local_caches[key]
+
+
+class TieredCache(object):
+    """
+    Puts LocalCache in front of the shared one, `get` and `set` of headers
+    lists and pages go through both tiers, control records (namespace
+    generations, locks, variants indexes, counters) and other operations
+    (`add`, etc.) are handled by the shared cache only
+    """
+
+    tiered_key_prefixes = (
+        'views.decorators.cache.cache_header.',
+        'views.decorators.cache.cache_page.',
+    )
+
+    control_key_re = re.compile(r'\.(lock|variants|bypass\.\d+)$')
+
+    def __init__(self, local_cache, shared_cache):
+        self.local_cache = local_cache
+        self.shared_cache = shared_cache
+
+    def __getattr__(self, item):
+        return getattr(self.shared_cache, item)
+
+    def is_tiered(self, key):
+        return key.startswith(self.tiered_key_prefixes) and not self.control_key_re.search(key)
+
+    def get(self, key, default=None, version=None):
+        if not self.is_tiered(key):
+            return self.shared_cache.get(key, default, version=version)
+        value = self.local_cache.get(key)
+        if value is None:
+            value = self.shared_cache.get(key, version=version)
+            if value is None:
+                return default
+            self.local_cache.set(key, value)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared_cache.set(key, value, timeout, version=version)
+        if self.is_tiered(key):
+            self.local_cache.set(key, value, None if timeout is DEFAULT_TIMEOUT else timeout)
+
+    def get_many(self, keys, version=None):
+        values = {}
+        for key in keys:
+            if self.is_tiered(key):
+                value = self.local_cache.get(key)
+                if value is not None:
+                    values[key] = value
+        missing_keys = [key for key in keys if key not in values]
+        if missing_keys:
+            shared_values = self.shared_cache.get_many(missing_keys, version=version)
+            for key, value in shared_values.items():
+                if self.is_tiered(key):
+                    self.local_cache.set(key, value)
+            values.update(shared_values)
+        return values
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared_cache.set_many(data, timeout, version=version)
+        for key, value in data.items():
+            if self.is_tiered(key):
+                self.local_cache.set(key, value, None if timeout is DEFAULT_TIMEOUT else timeout)
+
+    def delete(self, key, version=None):
+        self.local_cache.delete(key)
+        self.shared_cache.delete(key, version=version)
+
+
+# last seen generations of namespaces by (cache alias, namespace)
+namespace_generations = {}
+
+
+def get_generation_key(namespace):
+    return 'djangocache.namespace.{}'.format(namespace)
+
+
+def new_generation():
+    # generation of evicted counter must not repeat the previous ones
+    return uuid.uuid4().int >> 65
+
+
+def invalidate_namespace(namespace, cache_alias=None):
+    """
+    Invalidates all pages of the namespace by increasing its generation
+    """
+    if cache_alias is None:
+        cache_alias = settings.CACHE_MIDDLEWARE_ALIAS
+    generation_key = get_generation_key(namespace)
+    shared_cache = caches[cache_alias]
+    try:
+        shared_cache.incr(generation_key)
+    except ValueError:
+        shared_cache.set(generation_key, new_generation(), None)
+    namespace_generations.pop((cache_alias, namespace), None)
+
+
+# max number of page keys kept by variants index of the URL
+MAX_INDEXED_VARIANTS = 1000
+
+
+def get_variants_index_key(header_key):
+    return header_key + '.variants'
+
+
+# serializes updates of variants indexes made by the process
+_variants_index_lock = threading.Lock()
+
+
+def update_variants_index(index, keys):
+    """
+    Returns index of all keys stored for the URL, the newest keys are the last
+    """
+    index = [key for key in index or [] if key not in keys]
+    index.extend(keys)
+    return index[-MAX_INDEXED_VARIANTS:]
+
+
+def add_to_variants_index(shared_cache, header_key, keys, timeout):
+    """
+    Adds keys of the page versions to the variants index of the URL
+    stored in the shared cache. The update is read-modify-write,
+    so updates made at the same time by other processes may be lost
+    """
+    index_key = get_variants_index_key(header_key)
+    with _variants_index_lock:
+        index = update_variants_index(shared_cache.get(index_key), keys)
+        shared_cache.set(index_key, index, timeout)
+
+
+def delete_local(cache_alias, keys):
+    with _local_caches_lock:
+        for (alias, _, _), local_cache in local_caches.items():
+            if alias == cache_alias:
+                for key in keys:
+                    local_cache.delete(key)
+
+
+def purge(
+    path,
+    method='GET',
+    key_prefix=None,
+    cache_alias=None,
+    host=None,
+    query_params=None,
+    namespace=None,
+    language=None,
+):
+    """
+    Removes all cached versions of the page (for all values of headers
+    from its Vary if the view indexes them), `path` is either absolute URL
+    or path along with `host`, `query_params` and `namespace` should be
+    the same as the view's ones, `language` is the one the page was cached
+    for (active one by default), returns list of removed keys
+    """
+    if key_prefix is None:
+        key_prefix = settings.CACHE_MIDDLEWARE_KEY_PREFIX
+    if cache_alias is None:
+        cache_alias = settings.CACHE_MIDDLEWARE_ALIAS
+    url = urlsplit(path)
+    host = url.netloc or host
+    if not host:
+        raise ValueError('host is required to purge {}'.format(path))
+    request = WSGIRequest({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': url.path or '/',
+        'QUERY_STRING': url.query,
+        'HTTP_HOST': host,
+        'wsgi.url_scheme': url.scheme or 'http',
+        'wsgi.input': six.BytesIO(),
+    })
+    if query_params is None:
+        query_params = getattr(settings, 'DJANGOCACHE_QUERY_PARAMS', None)
+    query_params = get_query_params(query_params)
+    if query_params is not None:
+        request._cache_key_request = CacheKeyRequest(request, query_string=query_params.get_query_string(request))
+    if language is not None:
+        # used by the key instead of the active language (see LocaleMiddleware)
+        request.LANGUAGE_CODE = language
+    shared_cache = caches[cache_alias]
+    if namespace is not None:
+        generation = shared_cache.get(get_generation_key(namespace))
+        if generation is None:
+            # nothing is cached in the namespace
+            return []
+        key_prefix = '{}.{}.{}'.format(key_prefix or '', namespace, generation)
+    header_key = get_cache_header_key(key_prefix, request)
+    index_key = get_variants_index_key(header_key)
+    records = shared_cache.get_many([header_key, index_key])
+    keys = [header_key, index_key] + records.get(index_key, [])
+    headerlist = records.get(header_key)
+    if headerlist is not None and index_key not in records:
+        # page was cached without index, only its versions
+        # for the request without any headers can be found
+        cache_key = get_cache_key(request, method, headerlist, key_prefix)
+        keys.append(cache_key)
+        keys.extend(cache_key + '.' + encoding for encoding in content_encoders)
+        keys.append(get_validators_key(request, headerlist, key_prefix))
+    shared_cache.delete_many(keys)
+    delete_local(cache_alias, keys)
+    return keys
+
+
+class ResponseCacheUpdater(object):
+
+    def __init__(self, middleware, request, response):
+        self.middleware = middleware
+        self.request = request
+        self.response = response
+
+    def close(self):
+        middleware = self.middleware
+        request = self.request
+        response = self.response
+        self.request = self.response = self.middleware = None
+        # do not save _closable_objects to cache, response is closed anyway
+        response._closable_objects = []
+        server_timing = response.get('Server-Timing')
+        if hasattr(request, '_cache_server_timing') and server_timing is not None:
+            # timings of the current request must not be cached,
+            # the header might be removed by other middleware
+            if request._cache_server_timing is None:
+                del response['Server-Timing']
+            else:
+                response['Server-Timing'] = request._cache_server_timing
+            deferred = self.update_cache(middleware, request, response)
+            response['Server-Timing'] = server_timing
+        else:
+            deferred = self.update_cache(middleware, request, response)
+        if not deferred:
+            middleware.release_lock(request)
+
+    @staticmethod
+    def update_cache(middleware, request, response):
+        """
+        Saves response to cache, returns True if the write was deferred
+        to the write-behind queue
+        """
+        if not is_cacheable(request, response):
+            return False
+
+        timeout = cache.get_max_age(response)
+        if timeout is None:
+            timeout = getattr(request, '_cache_timeout', None)
+        if not timeout:
+            return False
+
+        frequency = getattr(request, '_cache_frequency', None)
+        if frequency is not None and frequency < middleware.admit_after:
+            # one-hit wonders don't evict popular pages
+            emit_event('not_admitted', request, size=len(response.content))
+            return False
+
+        if middleware.stale_while_revalidate:
+            # keep stale entry to serve it while page is being regenerated
+            timeout += middleware.stale_while_revalidate
+
+        if middleware.auto_etag and not response.has_header('ETag'):
+            # computed once per cache update, served by all cache hits
+            response['ETag'] = http.quote_etag(hashlib.md5(response.content).hexdigest())
+
+        key_prefix = getattr(request, '_cache_key_prefix', None)
+        regeneration_time = getattr(request, '_cache_regeneration_time', None)
+        if middleware.precompress:
+            variants = precompress_response(response)
+        else:
+            variants = {None: response}
+        headerlist = get_headerlist(
+            response,
+            ignore_headers=['HTTP_ACCEPT_ENCODING'] if len(variants) > 1 else [],
+        )
+        header_key = get_cache_header_key(key_prefix, request)
+        cache_key = get_cache_key(request, request.method, headerlist, key_prefix)
+        records = {header_key: headerlist}
+        if middleware.validators and ('ETag' in response or 'Last-Modified' in response):
+            validators_key = get_validators_key(request, headerlist, key_prefix)
+            records[validators_key] = {
+                header: response[header]
+                for header in rfc7232_headers
+                if header in response
+            }
+        for encoding, variant in variants.items():
+            if encoding is None:
+                records[cache_key] = encode_response(
+                    variant,
+                    codec=middleware.codec,
+                    min_size=middleware.get_compress_min_size(),
+                    regeneration_time=regeneration_time,
+                )
+            else:
+                # already compressed
+                records[cache_key + '.' + encoding] = encode_response(
+                    variant,
+                    regeneration_time=regeneration_time,
+                )
+        indexed_keys = None
+        if middleware.index_variants:
+            # keys of all versions of the page are kept for purge()
+            indexed_keys = [key for key in records if key != header_key]
+        deferred = bool(middleware.write_behind)
+        if deferred:
+            # lock is released only when the page is actually in cache,
+            # write time is the time of `set_many` of the batch
+            get_write_behind_queue().put(
+                middleware.cache,
+                records,
+                timeout,
+                callback=functools.partial(
+                    ResponseCacheUpdater.written,
+                    middleware,
+                    request,
+                    len(response.content),
+                    header_key,
+                    indexed_keys,
+                    timeout,
+                ),
+            )
+        else:
+            started = default_timer()
+            middleware.cache.set_many(records, timeout)
+            emit_event('write', request, size=len(response.content), write_time=default_timer() - started)
+            if indexed_keys:
+                add_to_variants_index(middleware.shared_cache, header_key, indexed_keys, timeout)
+        return deferred
+
+    @staticmethod
+    def written(middleware, request, size, header_key, indexed_keys, timeout, write_time):
+        """
+        Called by write-behind queue after the write, `write_time`
+        is None if the write was dropped or failed
+        """
+        middleware.release_lock(request)
+        if write_time is None:
+            return
+        emit_event('write', request, size=size, write_time=write_time)
+        if indexed_keys:
+            # indexes are updated one by one by the write-behind thread
+            add_to_variants_index(middleware.shared_cache, header_key, indexed_keys, timeout)
+
+
+class CacheMiddleware(cache_middleware.CacheMiddleware):
+    """
+    Despite of the original one this middleware supports
+    callable 'key_prefix' and 'cache_timeout'
+    """
+
+    CONDITIONAL_VARY_HEADERS = {
+        'HTTP_IF_NONE_MATCH': 'If-None-Match',
+        'HTTP_IF_MATCH': 'If-Match',
+    }
+
+    LOCK_POLL_INTERVAL = 0.05
+
+    def __init__(
+        self,
+        cache_min_age=None,
+        coalesce=False,
+        lock_timeout=None,
+        lock_wait_timeout=None,
+        stale_while_revalidate=None,
+        local_cache_size=None,
+        local_ttl=None,
+        compress=False,
+        compress_min_size=None,
+        precompress=False,
+        validators=False,
+        auto_etag=False,
+        write_behind=False,
+        early_expiration=None,
+        namespace=None,
+        early=False,
+        admit_after=None,
+        query_params=None,
+        vary_normalizers=None,
+        cookies=None,
+        bypass_limit=None,
+        bypass_window=None,
+        index_variants=False,
+        *args,
+        **kwargs
+    ):
+        self.cache_min_age = cache_min_age
+        self.coalesce = coalesce
+        self.lock_timeout = lock_timeout
+        self.lock_wait_timeout = lock_wait_timeout
+        self.stale_while_revalidate = stale_while_revalidate
+        self.codec = get_codec(compress)
+        self.compress_min_size = compress_min_size
+        self.precompress = precompress
+        self.validators = validators
+        self.auto_etag = auto_etag
+        self.write_behind = write_behind
+        self.early_expiration = early_expiration
+        self.namespace = namespace
+        self.early = early
+        self.admit_after = admit_after
+        if query_params is None:
+            query_params = getattr(settings, 'DJANGOCACHE_QUERY_PARAMS', None)
+        self.query_params = get_query_params(query_params)
+        if vary_normalizers is None:
+            vary_normalizers = getattr(settings, 'DJANGOCACHE_VARY_NORMALIZERS', {})
+        self.vary_normalizers = get_vary_normalizers(vary_normalizers)
+        if cookies is None:
+            cookies = getattr(settings, 'DJANGOCACHE_COOKIES', None)
+        self.cookies = get_cookies(cookies)
+        self.bypass_limit = bypass_limit
+        self.bypass_window = bypass_window
+        self.index_variants = index_variants
+        # the only state shared between requests, used just as a hint
+        self.headerlist = []
+        super(CacheMiddleware, self).__init__(*args, **kwargs)
+        # control records (locks, generations, etc.) bypass the local cache
+        self.shared_cache = self.cache
+        local_cache = get_local_cache(self.cache_alias, local_cache_size, local_ttl)
+        if local_cache is not None:
+            self.cache = TieredCache(local_cache, self.cache)
+        if callable(self.key_prefix):
+            self.get_key_prefix = self.key_prefix
+        if callable(self.cache_timeout):
+            self.get_cache_timeout = self.cache_timeout
+        if callable(self.namespace):
+            self.get_namespace = self.namespace
+
+    def get_cache_timeout(self, request, *args, **kwargs):
+        return self.cache_timeout
+
+    def get_key_prefix(self, request, *args, **kwargs):
+        return self.key_prefix
+
+    def get_namespace(self, request, *args, **kwargs):
+        return self.namespace
+
+    def get_compress_min_size(self):
+        if self.compress_min_size is None:
+            return getattr(settings, 'DJANGOCACHE_COMPRESS_MIN_SIZE', 1024)
+        return self.compress_min_size
+
+    def process_request(self, request, early=False):
+        """
+        Returns cached response if any, `early` lookups (made
+        by `EarlyCacheMiddleware`) have no side effects on a miss,
+        the view middleware continues from their results
+        """
+        if getattr(request, '_cache_revalidate', False):
+            # background regeneration of the stale page,
+            # key prefix is inherited from the original request
+            request._cache_update_cache = True
+            self.set_key_request(request)
+            self.start_view_timing(request, 'refresh')
+            return None
+
+        early_miss = getattr(request, '_cache_early_miss', None)
+        if early_miss is not None:
+            # the lookup has been made by EarlyCacheMiddleware,
+            # keys and normalized headers of the request are reused
+            request._cache_early_miss = None
+            outcome, event_kwargs = early_miss
+            if outcome != 'miss' or not self.coalesce:
+                return self.regenerate(request, outcome, **event_kwargs)
+            timing = getattr(request, '_cache_timing', None)
+            started = default_timer() - event_kwargs['lookup_time']
+            response = None
+        else:
+            if self.vary_normalizers and request.method in ('GET', 'HEAD'):
+                # the view gets the same normalized headers as used
+                # by the keys of the page versions
+                for meta_key, normalizer in self.vary_normalizers:
+                    value = request.META.get(meta_key)
+                    if value is not None:
+                        request.META[meta_key] = normalizer(value)
+
+            request._cache_key_prefix = key_prefix = self.get_key_prefix(
+                request,
+                *request.resolver_match.args,
+                **request.resolver_match.kwargs
+            )
+            self.set_key_request(request)
+            namespace = self.get_namespace(
+                request,
+                *request.resolver_match.args,
+                **request.resolver_match.kwargs
+            )
+
+            timing = None
+            if getattr(settings, 'DJANGOCACHE_SERVER_TIMING', False):
+                request._cache_timing = timing = {}
+
+            started = default_timer()
+            response = self.fetch_response(request, key_prefix, namespace)
+
+        key_prefix = request._cache_key_prefix  # includes namespace generation
+
+        if response is None and self.coalesce and request._cache_update_cache and not early:
+            response = self.wait_for_response(request, key_prefix)
+        lookup_time = default_timer() - started
+        if timing is not None:
+            timing['lookup'] = lookup_time - timing.get('decode', 0)
+
+        if response is None:
+            if request._cache_update_cache:
+                return self.regenerate(request, 'miss', early, lookup_time=lookup_time)
+            return None
+
+        # check if we should return "304 Not Modified",
+        # regeneration time is known only by the cached page
+        cached_response = response
+        if timing is None:
+            response = get_conditional_response(request, response)
+        else:
+            started = default_timer()
+            response = get_conditional_response(request, response)
+            timing['conditional'] = default_timer() - started
+        event = 'not_modified' if response.status_code == 304 else 'hit'
+        age = None
+
+        # setting cache age
+        if 'Expires' in response:
+            max_age = get_cache_max_age(response.get('Cache-Control'))
+            if max_age:
+                expires = http.parse_http_date(response['Expires'])
+                timeout = expires - int(time.time())
+                response['Age'] = age = max_age - timeout
+
+                # check cache age limit provided by client
+                age_limit = get_cache_max_age(request.META.get('HTTP_CACHE_CONTROL'))
+                if age_limit is None and request.META.get('HTTP_PRAGMA') == 'no-cache':
+                    age_limit = 0
+                if age_limit is not None:
+                    min_age = self.cache_min_age
+                    if min_age is None:
+                        min_age = getattr(settings, 'DJANGOCACHE_MIN_AGE', 0)
+                    age_limit = max(min_age, age_limit)
+                    if age >= age_limit:
+                        if not self.is_bypass_throttled(request):
+                            return self.regenerate(request, 'bypass', early, age=age, lookup_time=lookup_time)
+                        event = 'bypass_throttled'
+
+                if timeout < 0 and self.stale_while_revalidate:
+                    response['Warning'] = '110 - "Response is Stale"'
+                    self.schedule_refresh(request, key_prefix)
+                    event = 'stale'
+                elif self.is_expired_early(request, cached_response, timeout):
+                    if self.stale_while_revalidate:
+                        self.schedule_refresh(request, key_prefix)
+                    else:
+                        return self.regenerate(request, 'early_expiration', early, age=age, lookup_time=lookup_time)
+
+        emit_event(event, request, age=age, size=len(response.content), lookup_time=lookup_time)
+        if timing is not None:
+            response['Server-Timing'] = get_server_timing(event, timing)
+        return response
+
+    def set_key_request(self, request):
+        if self.query_params is not None or self.cookies is not None:
+            request._cache_key_request = CacheKeyRequest(
+                request,
+                query_string=self.query_params and self.query_params.get_query_string(request),
+                cookie=self.cookies and self.cookies.get_cookie(request),
+            )
+
+    def regenerate(self, request, outcome, early=False, **event_kwargs):
+        if early:
+            # the view middleware continues after the rest of middleware
+            request._cache_early_miss = outcome, event_kwargs
+            return None
+        request._cache_update_cache = True
+        if outcome == 'miss' and self.admit_after:
+            # only misses are counted, pages which are already
+            # in cache are always updated
+            request._cache_frequency = get_admission_sketch().add(request._cache_header_key)
+        emit_event(outcome, request, **event_kwargs)
+        self.start_view_timing(request, outcome)
+        return None
+
+    def is_bypass_throttled(self, request):
+        """
+        Counts regenerations of the page forced by clients in the shared
+        cache, returns True if the limit for the current window is exceeded
+        """
+        bypass_limit = self.bypass_limit
+        if bypass_limit is None:
+            bypass_limit = getattr(settings, 'DJANGOCACHE_BYPASS_LIMIT', None)
+        if bypass_limit is None:
+            return False
+        bypass_window = self.bypass_window
+        if bypass_window is None:
+            bypass_window = getattr(settings, 'DJANGOCACHE_BYPASS_WINDOW', 60)
+        # the window is a part of the key, so backends which reset
+        # expiration time on `incr` (`get` and `set`) can't prolong it
+        counter_key = '{}.bypass.{}'.format(request._cache_header_key, int(time.time() // bypass_window))
+        self.shared_cache.add(counter_key, 0, bypass_window)
+        try:
+            count = self.shared_cache.incr(counter_key)
+        except ValueError:
+            # evicted right after `add`
+            return False
+        return count > bypass_limit
+
+    def is_expired_early(self, request, response, timeout):
+        """
+        Probabilistic early expiration (XFetch): the closer the page
+        to expiration and the longer its regeneration, the more chances
+        to regenerate it before it actually expires. The chance is drawn
+        once per request, a repeated lookup (after `EarlyCacheMiddleware`)
+        gets the same result
+        """
+        if not self.early_expiration or timeout <= 0:
+            return False
+        regeneration_time = getattr(response, '_cache_regeneration_time', None)
+        if not regeneration_time:
+            return False
+        draw = getattr(request, '_cache_early_expiration_draw', None)
+        if draw is None:
+            request._cache_early_expiration_draw = draw = -math.log(1 - random.random())
+        return regeneration_time * self.early_expiration * draw >= timeout
+
+    @staticmethod
+    def start_view_timing(request, outcome):
+        request._cache_outcome = outcome
+        request._cache_view_started = default_timer()
+
+    @staticmethod
+    def finish_view_timing(request, response):
+        if not hasattr(request, '_cache_view_started'):
+            return
+        request._cache_regeneration_time = regeneration_time = default_timer() - request._cache_view_started
+        timing = getattr(request, '_cache_timing', None)
+        if timing is None:
+            return
+        timing['view'] = regeneration_time
+        # keep Server-Timing set by the view, it is restored before caching
+        request._cache_server_timing = response.get('Server-Timing')
+        server_timing = get_server_timing(request._cache_outcome, timing)
+        if request._cache_server_timing:
+            server_timing = request._cache_server_timing + ', ' + server_timing
+        response['Server-Timing'] = server_timing
+
+    def schedule_refresh(self, request, key_prefix):
+        lock_key = self.get_lock_key(request, key_prefix)
+        # the original request (its session, user, etc.) is still being
+        # served by another thread, the refresh builds its own one from
+        # a copy of META (with headers normalized by `vary_normalizers`)
+        environ = dict(request.META, **{'wsgi.input': six.BytesIO()})
+        get_refresh_executor().submit(lock_key, self.refresh, environ, key_prefix, lock_key)
+
+    def refresh(self, environ, key_prefix, lock_key):
+        request = WSGIRequest(environ)
+        request._cache_revalidate = True
+        request._cache_key_prefix = key_prefix
+        if not self.acquire_lock(request, lock_key):
+            # page is being regenerated by another process
+            return
+        db.close_old_connections()
+        try:
+            # the page goes through all middleware, so the cached
+            # headers list includes values of Vary patched by them
+            handler = BaseHandler()
+            handler.load_middleware()
+            response = handler.get_response(request)
+            response.close()
+        finally:
+            self.release_lock(request)
+            db.close_old_connections()
+
+    def fetch_response(self, request, key_prefix, namespace=None):
+        if request.method not in ('GET', 'HEAD'):
+            request._cache_update_cache = False
+            return None  # Don't bother checking the cache.
+
+        response = None
+        base_key_prefix = key_prefix
+        generation_key = None
+        if namespace is not None:
+            generation = namespace_generations.get((self.cache_alias, namespace))
+            if generation is None:
+                generation = self.load_generation(namespace)
+            else:
+                # last seen generation is checked along with the page
+                generation_key = get_generation_key(namespace)
+            key_prefix = '{}.{}.{}'.format(key_prefix or '', namespace, generation)
+        request._cache_key_prefix = key_prefix
+
+        request._cache_header_key = header_key = get_cache_header_key(key_prefix, request)
+
+        # headers list is usually the same for all pages of the view,
+        # so the page can be loaded along with the headers list
+        # in one round trip using the last seen headers list
+        prefetch_headerlist = self.headerlist
+        prefetch_page_keys = None
+        if self.validators and self.is_conditional(request):
+            # page itself probably won't be needed
+            prefetch_key = get_validators_key(request, prefetch_headerlist, key_prefix)
+        else:
+            prefetch_page_keys = self.get_page_keys(request, prefetch_headerlist, key_prefix)
+            prefetch_key = prefetch_page_keys[0]
+        keys = [header_key, prefetch_key]
+        if generation_key is not None:
+            keys.append(generation_key)
+        prefetched = self.cache.get_many(keys)
+        prefetched.setdefault(prefetch_key, None)
+
+        if generation_key is not None and prefetched.pop(generation_key, None) != generation:
+            # namespace has been invalidated
+            namespace_generations.pop((self.cache_alias, namespace), None)
+            return self.fetch_response(request, base_key_prefix, namespace)
+
+        headerlist = prefetched.pop(header_key, None)
+        if headerlist is not None:
+            self.headerlist = headerlist
+            if self.validators and self.is_conditional(request):
+                response = self.load_validators(request, headerlist, key_prefix, prefetched)
+            if response is None:
+                if prefetch_page_keys is not None and headerlist == prefetch_headerlist:
+                    page_keys = prefetch_page_keys
+                else:
+                    page_keys = self.get_page_keys(request, headerlist, key_prefix)
+                response = self.load_response(page_keys, prefetched, getattr(request, '_cache_timing', None))
+
+        # regenerate page if it is missing or its record has unknown format
+        request._cache_update_cache = response is None
+        return response
+
+    def load_generation(self, namespace):
+        generation_key = get_generation_key(namespace)
+        generation = self.shared_cache.get(generation_key)
+        if generation is None:
+            self.shared_cache.add(generation_key, new_generation(), None)
+            generation = self.shared_cache.get(generation_key)
+        namespace_generations[self.cache_alias, namespace] = generation
+        return generation
+
+    def get_page_keys(self, request, headerlist, key_prefix):
+        """
+        Returns keys of the page versions suitable for the request
+        in order of preference
+        """
+        cache_key = get_cache_key(request, 'GET', headerlist, key_prefix)
+        page_keys = [cache_key]
+        if self.precompress:
+            accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+            page_keys[:0] = [
+                cache_key + '.' + encoding
+                for encoding in get_accepted(accept_encoding, content_encoders)
+            ]
+        if request.method == 'HEAD':
+            # if there is no GET version of the page try the HEAD one
+            page_keys.append(get_cache_key(request, 'HEAD', headerlist, key_prefix))
+        return page_keys
+
+    def get_cached(self, key, prefetched):
+        if key in prefetched:
+            return prefetched[key]
+        return self.cache.get(key)
+
+    @staticmethod
+    def is_conditional(request):
+        return 'HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META
+
+    def load_validators(self, request, headerlist, key_prefix, prefetched):
+        """
+        Returns "304 Not Modified" (or "412 Precondition Failed") response
+        using only validators of the page, the page itself is not loaded
+        """
+        validators_key = get_validators_key(request, headerlist, key_prefix)
+        validators = self.get_cached(validators_key, prefetched)
+        if not validators:
+            return None
+        response = build_response(200, {
+            header.lower(): (header, value)
+            for header, value in validators.items()
+        }, b'')
+        conditional_response = get_conditional_response(request, response)
+        if conditional_response is response:
+            return None
+        return conditional_response
+
+    def load_response(self, page_keys, prefetched, timing=None):
+        for page_key in page_keys:
+            record = self.get_cached(page_key, prefetched)
+            if timing is None:
+                response = decode_response(record)
+            else:
+                started = default_timer()
+                response = decode_response(record)
+                timing['decode'] = timing.get('decode', 0) + default_timer() - started
+            if response is not None:
+                return response
+        return None
+
+    def get_lock_key(self, request, key_prefix):
+        key_request = getattr(request, '_cache_key_request', request)
+        cache_key = cache.get_cache_key(key_request, key_prefix, 'GET', cache=self.cache)
+        if cache_key is None:
+            # headers list is unknown yet, lock whole URL
+            cache_key = get_cache_header_key(key_prefix, request)
+        return cache_key + '.lock'
+
+    def acquire_lock(self, request, lock_key):
+        lock_timeout = self.lock_timeout
+        if lock_timeout is None:
+            lock_timeout = getattr(settings, 'DJANGOCACHE_LOCK_TIMEOUT', 10)
+        lock_token = uuid.uuid4().hex
+        if self.shared_cache.add(lock_key, lock_token, lock_timeout):
+            request._cache_lock = lock_key, lock_token
+            return True
+        return False
+
+    def release_lock(self, request):
+        lock = getattr(request, '_cache_lock', None)
+        if lock is None:
+            return
+        request._cache_lock = None
+        lock_key, lock_token = lock
+        if self.shared_cache.get(lock_key) == lock_token:
+            # lock may be already expired and acquired by another request
+            self.shared_cache.delete(lock_key)
+
+    def wait_for_response(self, request, key_prefix):
+        """
+        Lets only one of concurrent requests regenerate the page,
+        others wait for the cache to be updated (request coalescing)
+        """
+        lock_key = self.get_lock_key(request, key_prefix)
+        wait_timeout = self.lock_wait_timeout
+        if wait_timeout is None:
+            wait_timeout = getattr(settings, 'DJANGOCACHE_LOCK_WAIT_TIMEOUT', 5)
+        attempts = int(wait_timeout / self.LOCK_POLL_INTERVAL)
+        for attempt in range(attempts + 1):
+            if self.acquire_lock(request, lock_key):
+                # page could be cached by the request held the lock before
+                response = self.fetch_response(request, key_prefix)
+                if response is not None:
+                    self.release_lock(request)
+                return response
+            if attempt == attempts:
+                break
+            time.sleep(self.LOCK_POLL_INTERVAL)
+            response = self.fetch_response(request, key_prefix)
+            if response is not None:
+                return response
+
+        # page regeneration takes too long, render it by ourselves
+        return None
+
+    def process_exception(self, request, exception):
+        self.release_lock(request)
+
+    def process_response(self, request, response):
+        self.finish_view_timing(request, response)
+
+        if not self._should_update_cache(request, response):
+            return response
+
+        last_modified = 'Last-Modified' in response
+        etag = 'ETag' in response
+
+        request._cache_timeout = cache_timeout = self.get_cache_timeout(
+            request,
+            *request.resolver_match.args,
+            **request.resolver_match.kwargs
+        )
+
+        conditional_vary_headers = [
+            http_header
+            for wsgi_header, http_header in self.CONDITIONAL_VARY_HEADERS.items()
+            if wsgi_header in request.META
+        ]
+        if conditional_vary_headers:
+            cache.patch_vary_headers(response, conditional_vary_headers)
+
+        if response.status_code == 304:  # Not Modified
+            cache.patch_response_headers(response, cache_timeout)
+            self.release_lock(request)
+        else:
+            # postpone cache update till the time when all values
+            # of Vary header are ready, see https://code.djangoproject.com/ticket/15855
+            response._closable_objects.append(ResponseCacheUpdater(
+                middleware=self,
+                request=request,
+                response=response,
+            ))
+
+            if is_cacheable(request, response):
+                max_age = cache.get_max_age(response)
+                if max_age is None:
+                    cache.patch_response_headers(response, cache_timeout)
+                elif max_age:  # max-age=0 means don't bother caching
+                    cache.patch_response_headers(response, max_age)
+
+        if self.stale_while_revalidate:
+            cache.patch_cache_control(
+                response,
+                stale_while_revalidate=self.stale_while_revalidate,
+            )
+
+        if not last_modified:
+            # patch_response_headers sets its own Last-Modified, remove it
+            del response['Last-Modified']
+        if not etag:
+            # patch_response_headers sets its own ETag, remove it
+            del response['ETag']
+
+        return response
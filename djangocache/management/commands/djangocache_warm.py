@@ -0,0 +1,238 @@
+import json
+import threading
+import time
+
+from timeit import default_timer
+from xml.etree import ElementTree
+
+from django import db
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import get_resolver, resolve, Resolver404, RegexURLResolver
+from django.test import Client
+from django.utils.regex_helper import normalize
+from django.utils.six.moves import queue
+from django.utils.six.moves.urllib.parse import urlsplit
+
+
+def get_cached_patterns(patterns, prefix='', namespace=None):
+    """
+    Yields (URL name, regex) of all patterns with views decorated
+    by `djangocache.cache_page`
+    """
+    for pattern in patterns:
+        regex = pattern.regex.pattern
+        if prefix and regex.startswith('^'):
+            regex = regex[1:]
+        if isinstance(pattern, RegexURLResolver):
+            pattern_namespace = namespace
+            if pattern.namespace:
+                pattern_namespace = ':'.join(filter(None, [namespace, pattern.namespace]))
+            for cached_pattern in get_cached_patterns(pattern.url_patterns, prefix + regex, pattern_namespace):
+                yield cached_pattern
+        elif getattr(pattern.callback, 'djangocache_cached', False):
+            name = pattern.name and ':'.join(filter(None, [namespace, pattern.name]))
+            yield name, prefix + regex
+
+
+def is_cached(path):
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return False
+    return getattr(match.func, 'djangocache_cached', False)
+
+
+class RateLimiter(object):
+    """
+    Lets no more than `rate` requests per second
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_request = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.time()
+            delay = self.next_request - now
+            self.next_request = max(now, self.next_request) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Command(BaseCommand):
+    help = (
+        'Fills the cache by requesting pages of views decorated by djangocache.cache_page. '
+        'Pages served with Age header are reported as already cached (hit), the rest ones as filled (miss).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--arguments', dest='arguments',
+            help='JSON file with lists of args (list) or kwargs (dict) by URL names, '
+                 'e.g. {"app:article": [{"slug": "first"}, {"slug": "second"}]}',
+        )
+        parser.add_argument(
+            '--sitemap', dest='sitemaps', action='append', default=[],
+            help='Path of the sitemap, its pages served by cached views are requested too',
+        )
+        parser.add_argument(
+            '--host', dest='host',
+            help='Host of the site, pages are cached per host. Default is the first of ALLOWED_HOSTS.',
+        )
+        parser.add_argument('--https', dest='https', action='store_true', help='Use https scheme.')
+        parser.add_argument(
+            '--header', dest='headers', action='append', default=[],
+            help='Header sent with each request, e.g. "Accept-Encoding: gzip"',
+        )
+        parser.add_argument(
+            '--concurrency', dest='concurrency', type=int, default=1,
+            help='Number of concurrent requests. Default is 1.',
+        )
+        parser.add_argument(
+            '--rate', dest='rate', type=float, default=0,
+            help='Max number of requests per second. Default is unlimited.',
+        )
+        parser.add_argument('--dry-run', dest='dry_run', action='store_true', help='Only list the pages.')
+
+    def handle(self, **options):
+        self.verbosity = options['verbosity']
+        host = options['host'] or self.get_default_host()
+        headers = {'HTTP_HOST': host}
+        for header in options['headers']:
+            name, _, value = header.partition(':')
+            headers['HTTP_' + name.strip().upper().replace('-', '_')] = value.strip()
+        client = Client(**headers)
+
+        urls = self.get_pattern_urls(options['arguments'])
+        for sitemap in options['sitemaps']:
+            urls.extend(self.get_sitemap_urls(client, sitemap, options['https']))
+        urls = sorted(set(urls))
+
+        if options['dry_run']:
+            for url in urls:
+                self.stdout.write(url)
+            return
+
+        results = self.warm(urls, headers, options)
+        self.report(results)
+
+    @staticmethod
+    def get_default_host():
+        for host in settings.ALLOWED_HOSTS:
+            if '*' not in host and not host.startswith('.'):
+                return host
+        return 'localhost'
+
+    def get_pattern_urls(self, arguments_file):
+        arguments = {}
+        if arguments_file:
+            with open(arguments_file) as arguments_file:
+                arguments = json.load(arguments_file)
+        urls = []
+        for name, regex in get_cached_patterns(get_resolver(None).url_patterns):
+            for template, params in normalize(regex):
+                if not params:
+                    urls.append('/' + template)
+                    continue
+                for args in arguments.get(name, []):
+                    if not isinstance(args, dict):
+                        if len(args) != len(params):
+                            continue
+                        args = dict(zip(params, args))
+                    if set(params) == set(args):
+                        urls.append('/' + template % args)
+                if name not in arguments and self.verbosity >= 2:
+                    self.stdout.write('Skipped {} ({}): no arguments provided'.format(name or '-', regex))
+        return urls
+
+    def get_sitemap_urls(self, client, sitemap, https):
+        response = client.get(sitemap, secure=https)
+        if response.status_code != 200:
+            raise CommandError('Failed to load sitemap {}: {}'.format(sitemap, response.status_code))
+        urls = []
+        for element in ElementTree.fromstring(response.content).iter():
+            if not element.tag.endswith('loc') or not element.text:
+                continue
+            url = urlsplit(element.text.strip())
+            if is_cached(url.path):
+                urls.append(url.path + ('?' + url.query if url.query else ''))
+        return urls
+
+    def warm(self, urls, headers, options):
+        urls_queue = queue.Queue()
+        for url in urls:
+            urls_queue.put(url)
+        rate_limiter = RateLimiter(options['rate'])
+        results = []
+        results_lock = threading.Lock()
+
+        def work():
+            try:
+                request_urls()
+            finally:
+                # each thread has its own connections
+                db.connections.close_all()
+
+        def request_urls():
+            client = Client(**headers)
+            while True:
+                try:
+                    url = urls_queue.get_nowait()
+                except queue.Empty:
+                    return
+                rate_limiter.wait()
+                # cookies set by previous pages must not select
+                # variants of `Vary: Cookie` pages
+                client.cookies.clear()
+                started = default_timer()
+                try:
+                    response = client.get(url, secure=options['https'])
+                except Exception as error:
+                    result = (url, 'error', repr(error), default_timer() - started)
+                else:
+                    if response.status_code != 200:
+                        outcome = 'error'
+                    elif 'Age' in response:
+                        # heuristic: cached pages are served with Age header
+                        outcome = 'hit'
+                    else:
+                        outcome = 'miss'
+                    result = (url, outcome, response.status_code, default_timer() - started)
+                with results_lock:
+                    results.append(result)
+                if self.verbosity >= 2:
+                    self.stdout.write('{:<5} {} {:.1f} ms {}'.format(result[1].upper(), result[2], result[3] * 1000, url))
+
+        threads = [threading.Thread(target=work) for _ in range(max(1, options['concurrency']))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def report(self, results):
+        outcomes = {'hit': [], 'miss': [], 'error': []}
+        for url, outcome, status, duration in results:
+            outcomes[outcome].append(duration)
+        self.stdout.write('Requested {} pages: {} filled (miss), {} already cached (hit), {} errors'.format(
+            len(results),
+            len(outcomes['miss']),
+            len(outcomes['hit']),
+            len(outcomes['error']),
+        ))
+        for outcome in ('miss', 'hit'):
+            durations = sorted(outcomes[outcome])
+            if not durations:
+                continue
+            self.stdout.write('{} time: avg {:.1f} ms, p50 {:.1f} ms, max {:.1f} ms, total {:.1f} s'.format(
+                'Fill' if outcome == 'miss' else 'Hit',
+                sum(durations) / len(durations) * 1000,
+                durations[len(durations) // 2] * 1000,
+                durations[-1] * 1000,
+                sum(durations),
+            ))
@@ -1,2 +1,6 @@
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = 'secret_key'
+
+INSTALLED_APPS = [
+    'djangocache',
+]
@@ -8,7 +8,11 @@ setup(
     version='0.3',
     author='Rinat Khabibiev',
     author_email='srenskiy@gmail.com',
-    py_modules=['djangocache'],
+    packages=[
+        'djangocache',
+        'djangocache.management',
+        'djangocache.management.commands',
+    ],
     url='https://github.com/renskiy/django-cache',
     license='MIT',
     description='Extended HTTP-caching for Django',
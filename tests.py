@@ -1,3 +1,14 @@
+import contextlib
+import gzip
+import hashlib
+import io
+import json
+import random
+import socket
+import struct
+import sys
+import tempfile
+import threading
 import time
 import unittest
 
@@ -6,13 +17,67 @@ from datetime import datetime
 import django
 import mock
 
-from django import test, http
+from django import db, test, http
 from django.conf import settings, urls
+from django.core import management
 from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
 from django.core.urlresolvers import reverse
+from django.utils import six, translation
+from django.utils.cache import get_cache_key, patch_vary_headers
+from django.utils.http import http_date
+from django.utils.six.moves import cPickle as pickle
 from django.views.decorators.http import last_modified, etag
 
-from djangocache import cache_page, get_cache_max_age
+from djangocache import (
+    cache_page,
+    CacheMiddleware,
+    compression_stats,
+    CountMinSketch,
+    get_codec,
+    decode_response,
+    encode_response,
+    get_admission_sketch,
+    get_query_params,
+    get_cookies,
+    get_cache_max_age,
+    get_refresh_executor,
+    get_write_behind_queue,
+    invalidate_namespace,
+    namespace_generations,
+    normalize_accept_encoding,
+    normalize_accept_language,
+    normalize_user_agent,
+    purge,
+    local_caches,
+    LocalCache,
+    get_stats_sinks,
+    StatsdStatsSink,
+    CacheEvent,
+    RefreshExecutor,
+    WriteBehindQueue,
+)
+
+@contextlib.contextmanager
+def switch_often():
+    # makes race conditions between threads much more probable
+    if six.PY3:
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            yield
+        finally:
+            sys.setswitchinterval(interval)
+    else:
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        try:
+            yield
+        finally:
+            sys.setcheckinterval(interval)
+
 
 mocked_response = mock.Mock(side_effect=lambda: http.HttpResponse())
 
@@ -60,12 +125,241 @@ def dynamic_cache_timeout(request):
 dynamic_cache_timeout.cache_timeout = 24 * 60 * 60
 
 
+@cache_page(cache_timeout=24 * 60 * 60, coalesce=True, lock_wait_timeout=1)
+def coalesce(request):
+    if not coalesce.started.is_set():
+        # only first request waits for the signal to finish
+        coalesce.started.set()
+        coalesce.finish.wait(5)
+    return mocked_response()
+coalesce.started = threading.Event()
+coalesce.finish = threading.Event()
+
+
+@cache_page(cache_timeout=600, stale_while_revalidate=300)
+def stale(request):
+    return mocked_response()
+
+
+@cache_page(cache_timeout=600, stale_while_revalidate=300)
+def stale_personal(request):
+    mocked_response()
+    return http.HttpResponse(request.COOKIES.get('user', ''))
+
+
+@cache_page(cache_timeout=600, local_cache_size=1024 * 1024, local_ttl=5)
+def local(request):
+    return mocked_response()
+
+
+@cache_page(cache_timeout=600, local_cache_size=1024 * 1024, local_ttl=5, namespace='tiered', coalesce=True)
+def tiered_tenant(request):
+    return mocked_response()
+
+
+@cache_page(cache_timeout=600, precompress=True)
+def precompressed(request):
+    mocked_response()
+    response = http.HttpResponse(b'body' * 100)
+    response['ETag'] = '"etag"'
+    return response
+
+
+@cache_page(cache_timeout=600, validators=True)
+@last_modified(lambda r: datetime.utcfromtimestamp(1468749300))
+@etag(lambda r: 'etag')
+def validators(request):
+    return mocked_response()
+
+
+@cache_page(cache_timeout=600, auto_etag=True, validators=True)
+def auto_etag(request):
+    mocked_response()
+    return http.HttpResponse(b'body')
+
+
+@cache_page(cache_timeout=600, compress='zlib', compress_min_size=100)
+def compressed(request):
+    mocked_response()
+    return http.HttpResponse(b'body' * int(request.GET.get('size', 100)))
+
+
+def vary_response():
+    mocked_response()
+    response = http.HttpResponse()
+    response['Vary'] = 'X-Header'
+    return response
+
+
+@cache_page(cache_timeout=600)
+def vary(request):
+    return vary_response()
+
+
+@cache_page(cache_timeout=600, coalesce=True, write_behind=True)
+def write_behind(request):
+    return mocked_response()
+
+
+@cache_page(cache_timeout=600, index_variants=True)
+def indexed(request):
+    return vary_response()
+
+
+@cache_page(cache_timeout=600, index_variants=True, write_behind=True)
+def indexed_queued(request):
+    return vary_response()
+
+
+@cache_page(cache_timeout=600, index_variants=True, local_cache_size=1024 * 1024, local_ttl=5)
+def indexed_tiered(request):
+    return vary_response()
+
+
+@cache_page(cache_timeout=600, index_variants=True, namespace='indexed')
+def indexed_tenant(request):
+    return vary_response()
+
+
+@cache_page(
+    key_prefix=lambda r: r.META['HTTP_X_PREFIX'],
+    cache_timeout=lambda r: int(r.META['HTTP_X_TIMEOUT']),
+)
+def concurrent(request):
+    return http.HttpResponse(request.META['HTTP_X_PREFIX'])
+
+
+@cache_page(cache_timeout=600, early_expiration=100, auto_etag=True)
+def early_expiration(request):
+    time.sleep(0.01)  # regeneration time
+    return mocked_response()
+
+
+@cache_page(cache_timeout=600, namespace=lambda r: 'tenant.' + r.GET['tenant'])
+def namespaced(request):
+    return mocked_response()
+
+
+@cache_page(cache_timeout=600, early=True)
+@etag(lambda r: 'etag')
+def early(request):
+    return mocked_response()
+
+
+@cache_page(
+    cache_timeout=600,
+    early=True,
+    stale_while_revalidate=300,
+    vary_normalizers={'User-Agent': normalize_user_agent},
+)
+def early_refreshed(request):
+    mocked_response()
+    response = http.HttpResponse(request.META['HTTP_USER_AGENT'])
+    response['Vary'] = 'User-Agent'
+    return response
+
+
+@cache_page(cache_timeout=600, early=True)
+def early_translated(request):
+    mocked_response()
+    return http.HttpResponse(translation.get_language())
+
+
+@cache_page(cache_timeout=600, admit_after=2)
+def admitted(request):
+    return mocked_response()
+
+
+@cache_page(cache_timeout=600, query_params={'deny': ['utm_*', 'fbclid']})
+def canonical_query(request):
+    mocked_response()
+    return http.HttpResponse(request.get_full_path())
+
+
+@cache_page(cache_timeout=600, query_params={'allow': ['page']})
+def allowed_query(request):
+    return mocked_response()
+
+
+@cache_page(cache_timeout=600, query_params=False)
+def ignored_query(request):
+    return mocked_response()
+
+
+@cache_page(cache_timeout=600, vary_normalizers={
+    'Accept-Encoding': 'djangocache.normalize_accept_encoding',
+    'Accept-Language': 'djangocache.normalize_accept_language',
+    'User-Agent': normalize_user_agent,
+})
+def normalized(request):
+    mocked_response()
+    response = http.HttpResponse('|'.join(
+        request.META.get(header, '-')
+        for header in ('HTTP_ACCEPT_ENCODING', 'HTTP_ACCEPT_LANGUAGE', 'HTTP_USER_AGENT')
+    ))
+    response['Vary'] = 'Accept-Encoding, Accept-Language, User-Agent'
+    return response
+
+
+@cache_page(cache_timeout=600, cookies=['sessionid'])
+def session_cookie(request):
+    mocked_response()
+    response = http.HttpResponse(request.COOKIES.get('sessionid', 'anonymous'))
+    response['Vary'] = 'Cookie'
+    return response
+
+
+@cache_page(cache_timeout=600, cookies=['sessionid'])
+def session_start(request):
+    mocked_response()
+    response = http.HttpResponse()
+    response['Vary'] = 'Cookie'
+    if 'sessionid' not in request.COOKIES:
+        response.set_cookie('sessionid', 'session-{}'.format(mocked_response.call_count))
+    return response
+
+
+@cache_page(cache_timeout=600, cookies={'deny': ['_ga', '_gid', '__utm*']})
+def analytics_cookies(request):
+    mocked_response()
+    response = http.HttpResponse()
+    response['Vary'] = 'Cookie'
+    return response
+
+
+@cache_page(cache_timeout=600, bypass_limit=1, bypass_window=60)
+def throttled(request):
+    return mocked_response()
+
+
+class CountingMiddleware(object):
+
+    calls = 0
+
+    def process_request(self, request):
+        CountingMiddleware.calls += 1
+
+
 class UpdateVaryMiddleware(object):
 
     def process_response(self, request, response):
         response['Vary'] = 'Header'
         return response
 
+
+class VaryCookieMiddleware(object):
+
+    def process_response(self, request, response):
+        patch_vary_headers(response, ['Cookie'])
+        return response
+
+
+class RemoveServerTimingMiddleware(object):
+
+    def process_response(self, request, response):
+        del response['Server-Timing']
+        return response
+
 urlpatterns = [
     urls.url(r'static2', static2, name='static2'),
     urls.url(r'static', static, name='static'),
@@ -75,18 +369,101 @@ urlpatterns = [
     urls.url(r'dynamic_cache_timeout', dynamic_cache_timeout, name='dynamic_cache_timeout'),
     urls.url(r'cache_with_last_modified$', cache_with_last_modified, name='cache_with_last_modified'),
     urls.url(r'cache_with_etag$', cache_with_etag, name='cache_with_etag'),
+    urls.url(r'coalesce$', coalesce, name='coalesce'),
+    urls.url(r'stale$', stale, name='stale'),
+    urls.url(r'stale_personal$', stale_personal, name='stale_personal'),
+    urls.url(r'local$', local, name='local'),
+    urls.url(r'precompressed$', precompressed, name='precompressed'),
+    urls.url(r'tiered_tenant$', tiered_tenant, name='tiered_tenant'),
+    urls.url(r'compressed$', compressed, name='compressed'),
+    urls.url(r'validators$', validators, name='validators'),
+    urls.url(r'auto_etag$', auto_etag, name='auto_etag'),
+    urls.url(r'vary$', vary, name='vary'),
+    urls.url(r'write_behind$', write_behind, name='write_behind'),
+    urls.url(r'indexed$', indexed, name='indexed'),
+    urls.url(r'indexed_queued$', indexed_queued, name='indexed_queued'),
+    urls.url(r'indexed_tiered$', indexed_tiered, name='indexed_tiered'),
+    urls.url(r'indexed_tenant$', indexed_tenant, name='indexed_tenant'),
+    urls.url(r'concurrent$', concurrent, name='concurrent'),
+    urls.url(r'early_expiration$', early_expiration, name='early_expiration'),
+    urls.url(r'namespaced$', namespaced, name='namespaced'),
+    urls.url(r'early$', early, name='early'),
+    urls.url(r'early_refreshed$', early_refreshed, name='early_refreshed'),
+    urls.url(r'early_translated$', early_translated, name='early_translated'),
+    urls.url(r'admitted$', admitted, name='admitted'),
+    urls.url(r'canonical_query$', canonical_query, name='canonical_query'),
+    urls.url(r'allowed_query$', allowed_query, name='allowed_query'),
+    urls.url(r'ignored_query$', ignored_query, name='ignored_query'),
+    urls.url(r'normalized$', normalized, name='normalized'),
+    urls.url(r'session_cookie$', session_cookie, name='session_cookie'),
+    urls.url(r'analytics_cookies$', analytics_cookies, name='analytics_cookies'),
+    urls.url(r'session_start$', session_start, name='session_start'),
+    urls.url(r'throttled$', throttled, name='throttled'),
 ]
 
 
+@cache_page(cache_timeout=600)
+def article(request, slug):
+    return mocked_response()
+
+
+def sitemap(request):
+    return http.HttpResponse(
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        '<url><loc>http://testserver/articles/sitemap</loc></url>'
+        '<url><loc>http://testserver/no_cache</loc></url>'
+        '</urlset>',
+        content_type='application/xml',
+    )
+
+
+class warm_urls:
+    urlpatterns = [
+        urls.url(r'^$', static, name='index'),
+        urls.url(r'^no_cache$', no_cache, name='no_cache'),
+        urls.url(r'^sitemap.xml$', sitemap, name='sitemap'),
+        urls.url(r'^articles/', urls.include([
+            urls.url(r'^(?P<slug>\w+)$', article, name='article'),
+        ])),
+    ]
+
+
+@cache_page(cache_timeout=600)
+def cookie_setting(request):
+    response = mocked_response()
+    response.set_cookie('csrftoken', 'token')
+    return response
+
+
+@cache_page(cache_timeout=600)
+def cookie_varying(request):
+    response = mocked_response()
+    response['Vary'] = 'Cookie'
+    return response
+
+
+class warm_cookie_urls:
+    urlpatterns = [
+        urls.url(r'^a$', cookie_setting, name='cookie_setting'),
+        urls.url(r'^b$', cookie_varying, name='cookie_varying'),
+    ]
+
+
 @test.utils.override_settings(ROOT_URLCONF=__name__)
 class CachePageTestCase(test.SimpleTestCase):
 
     def setUp(self):
         dynamic_key_prefix.key_prefix = 'key_prefix'
+        coalesce.started.clear()
+        coalesce.finish.set()
 
     def tearDown(self):
         mocked_response.reset_mock()
         caches[settings.CACHE_MIDDLEWARE_ALIAS].clear()
+        for local_cache in local_caches.values():
+            local_cache.clear()
+        namespace_generations.clear()
 
     def test_default(self):
         client = test.Client()
@@ -677,3 +1054,1348 @@ class CachePageTestCase(test.SimpleTestCase):
     def test_get_cache_max_age_returns_none_on_wrong_or_empty_result(self):
         self.assertIsNone(get_cache_max_age('max-age=a'))
         self.assertIsNone(get_cache_max_age('max-age='))
+
+    def test_coalesce(self):
+        responses = []
+
+        def make_request():
+            responses.append(test.Client().get(reverse('coalesce')))
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            coalesce.finish.clear()
+            leader = threading.Thread(target=make_request)
+            leader.start()
+            self.assertTrue(coalesce.started.wait(5))
+
+            followers = [threading.Thread(target=make_request) for _ in range(3)]
+            for follower in followers:
+                follower.start()
+            time.sleep(0.2)
+            coalesce.finish.set()
+            for thread in [leader] + followers:
+                thread.join(5)
+
+            mocked_response.assert_called_once()
+            self.assertEqual(4, len(responses))
+            for response in responses:
+                self.assertEqual(200, response.status_code)
+                self.assertEqual('Mon, 18 Jul 2016 10:00:00 GMT', response['Expires'])
+            lock_keys = [
+                key for key in caches[settings.CACHE_MIDDLEWARE_ALIAS]._cache
+                if key.endswith('.lock')
+            ]
+            self.assertEqual([], lock_keys)
+
+    def test_coalesce_wait_timeout(self):
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            coalesce.finish.clear()
+            leader = threading.Thread(target=test.Client().get, args=[reverse('coalesce')])
+            leader.start()
+            self.assertTrue(coalesce.started.wait(5))
+
+            with mock.patch.object(time, 'sleep') as sleep:
+                response = test.Client().get(reverse('coalesce'))
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(20, sleep.call_count)
+            mocked_response.assert_called_once()
+
+            coalesce.finish.set()
+            leader.join(5)
+            self.assertEqual(2, mocked_response.call_count)
+
+    def test_coalesce_lock_released(self):
+        acquire_lock = CacheMiddleware.acquire_lock
+        requests = []
+
+        def acquire_lock_after_leader(middleware, request, lock_key):
+            requests.append(request)
+            if len(requests) == 1:
+                # the leader caches the page and releases the lock
+                # between the lookup of the follower and its attempt to lock
+                test.Client().get(reverse('coalesce'))
+            return acquire_lock(middleware, request, lock_key)
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            coalesce.finish.set()
+            with mock.patch.object(CacheMiddleware, 'acquire_lock', acquire_lock_after_leader):
+                response = test.Client().get(reverse('coalesce'))
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(2, len(requests))
+            mocked_response.assert_called_once()
+
+    def test_stale_while_revalidate(self):
+        client = test.Client()
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            response = client.get(reverse('stale'))
+            mocked_response.assert_called_once()
+            self.assertEqual('Sun, 17 Jul 2016 10:10:00 GMT', response['Expires'])
+            self.assertEqual(
+                {'max-age=600', 'stale-while-revalidate=300'},
+                set(response['Cache-Control'].split(', ')),
+            )
+            mocked_response.reset_mock()
+
+        # Sun, 17 Jul 2016 10:12:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468750320):
+            response = client.get(reverse('stale'))
+            self.assertEqual(200, response.status_code)
+            self.assertEqual('Sun, 17 Jul 2016 10:10:00 GMT', response['Expires'])
+            self.assertEqual('720', response['Age'])
+            self.assertEqual('110 - "Response is Stale"', response['Warning'])
+
+            get_refresh_executor().queue.join()
+            mocked_response.assert_called_once()
+            mocked_response.reset_mock()
+
+            response = client.get(reverse('stale'))
+            mocked_response.assert_not_called()
+            self.assertNotIn('Warning', response)
+            self.assertEqual('Sun, 17 Jul 2016 10:22:00 GMT', response['Expires'])
+            self.assertEqual('0', response['Age'])
+
+        # Sun, 17 Jul 2016 10:40:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468752000):
+            response = client.get(reverse('stale'))
+            mocked_response.assert_called_once()
+            self.assertNotIn('Warning', response)
+            self.assertNotIn('Age', response)
+            self.assertEqual('Sun, 17 Jul 2016 10:50:00 GMT', response['Expires'])
+
+    @test.utils.override_settings(MIDDLEWARE_CLASSES=[__name__ + '.VaryCookieMiddleware'])
+    def test_stale_while_revalidate_vary_changed_by_middleware(self):
+        alice = test.Client()
+        alice.cookies['user'] = 'alice'
+        bob = test.Client()
+        bob.cookies['user'] = 'bob'
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            response = alice.get(reverse('stale_personal'))
+            self.assertEqual(b'alice', response.content)
+            self.assertEqual('Cookie', response['Vary'])
+            response = bob.get(reverse('stale_personal'))
+            self.assertEqual(b'bob', response.content)
+            self.assertEqual(2, mocked_response.call_count)
+            mocked_response.reset_mock()
+
+        # Sun, 17 Jul 2016 10:12:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468750320):
+            response = alice.get(reverse('stale_personal'))
+            self.assertEqual(b'alice', response.content)
+            self.assertEqual('110 - "Response is Stale"', response['Warning'])
+
+            # refreshed page went through the middleware patching Vary
+            get_refresh_executor().queue.join()
+            mocked_response.assert_called_once()
+            mocked_response.reset_mock()
+
+            response = alice.get(reverse('stale_personal'))
+            self.assertEqual(b'alice', response.content)
+            self.assertEqual('0', response['Age'])
+            response = bob.get(reverse('stale_personal'))
+            self.assertEqual(b'bob', response.content)
+            self.assertEqual('110 - "Response is Stale"', response['Warning'])
+            response = test.Client().get(reverse('stale_personal'))
+            self.assertEqual(b'', response.content)
+            get_refresh_executor().queue.join()
+            self.assertEqual(2, mocked_response.call_count)
+
+    def test_refresh_executor_single_flight(self):
+        executor = RefreshExecutor(workers=1, queue_size=2)
+        started = threading.Event()
+        finish = threading.Event()
+        calls = []
+
+        def job(name):
+            calls.append(name)
+            started.set()
+            finish.wait(5)
+
+        self.assertTrue(executor.submit('key1', job, 'key1'))
+        self.assertTrue(started.wait(5))
+        self.assertFalse(executor.submit('key1', job, 'key1'))
+        self.assertTrue(executor.submit('key2', job, 'key2'))
+        self.assertTrue(executor.submit('key3', job, 'key3'))
+        self.assertFalse(executor.submit('key4', job, 'key4'))  # queue is full
+        finish.set()
+        executor.queue.join()
+        self.assertEqual(['key1', 'key2', 'key3'], calls)
+        self.assertTrue(executor.submit('key1', job, 'key1'))
+        executor.queue.join()
+
+    @test.utils.override_settings(DJANGOCACHE_STATS_SINKS=[
+        {'BACKEND': 'djangocache.MemoryStatsSink'},
+    ])
+    def test_write_behind(self):
+        client = test.Client()
+        queue = get_write_behind_queue()
+        sink, = get_stats_sinks()
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            with queue.flush_lock:  # suspend background flushes
+                response = client.get(reverse('write_behind'))
+                self.assertEqual(200, response.status_code)
+                self.assertEqual(1, queue.depth)
+                # regeneration lock is held until the page is written
+                locks = lambda: [key for key in caches['default']._cache if key.endswith('.lock')]
+                self.assertEqual(1, len(locks()))
+                # write is reported when it's actually done
+                self.assertNotIn('write', sink.stats()['write_behind'])
+            queue.flush()
+            self.assertEqual(0, queue.depth)
+            self.assertEqual([], locks())
+            self.assertEqual(1, sink.stats()['write_behind']['write'])
+            self.assertGreater(sink.stats()['write_behind']['write_time'], 0)
+            client.get(reverse('write_behind'))
+            mocked_response.assert_called_once()
+
+    def test_write_behind_queue(self):
+        queue = WriteBehindQueue(max_size=2, batch_size=10)
+        cache = caches['default']
+        callback = mock.Mock()
+
+        with queue.flush_lock, mock.patch('djangocache.logger') as logger:  # suspend background flushes
+            queue.put(cache, {'key1': 1}, 600, callback=lambda write_time: callback('key1', write_time))
+            queue.put(cache, {'key2': 2, 'key3': 3}, 600, callback=lambda write_time: callback('key2', write_time))
+            queue.put(cache, {'key2': 4}, 60, callback=lambda write_time: callback('key4', write_time))
+            # the oldest write is dropped
+            self.assertEqual(2, queue.depth)
+            self.assertEqual(1, queue.dropped)
+            callback.assert_called_once_with('key1', None)
+            callback.reset_mock()
+            queue.put(cache, {'key5': 5}, 600)
+        self.assertEqual(
+            [
+                mock.call('Write-behind queue is full, dropped %d records', 1),
+                mock.call('Write-behind queue is full, dropped %d records', 2),
+            ],
+            logger.warning.call_args_list,
+        )
+        queue.flush()
+
+        self.assertEqual(0, queue.depth)
+        self.assertEqual(2, queue.dropped)
+        self.assertEqual(2, queue.written)
+        # callbacks of both dropped and written records are called
+        (dropped, dropped_time), (written, write_time) = [args for args, _ in callback.call_args_list]
+        self.assertEqual(('key2', None), (dropped, dropped_time))
+        self.assertEqual('key4', written)
+        self.assertGreater(write_time, 0)  # time of set_many
+        self.assertIsNone(cache.get('key1'))
+        self.assertEqual(4, cache.get('key2'))
+        self.assertIsNone(cache.get('key3'))  # dropped
+        self.assertEqual(5, cache.get('key5'))
+        stats = queue.stats()
+        self.assertGreater(stats['flush_time'], 0)
+        self.assertEqual(1, stats['flushes'])
+
+    def test_concurrent_requests(self):
+        # all threads share the same view (and middleware instance),
+        # pages differ only by key prefix and timeout
+        errors = []
+
+        def worker(number):
+            client = test.Client()
+            prefix = 'prefix{}'.format(number)
+            timeout = 100 + number
+            try:
+                for page in range(50):
+                    # the same pages are requested by all threads
+                    response = client.get(
+                        reverse('concurrent'),
+                        data=dict(page=page % 10),
+                        HTTP_X_PREFIX=prefix,
+                        HTTP_X_TIMEOUT=str(timeout),
+                    )
+                    if response.content != prefix.encode():
+                        errors.append((prefix, response.content))
+                    if response['Cache-Control'] != 'max-age={}'.format(timeout):
+                        errors.append((prefix, response['Cache-Control']))
+                    if response['Expires'] != http_date(1468749600 + timeout):
+                        errors.append((prefix, response['Expires']))
+            except Exception as error:
+                errors.append((prefix, error))
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600), switch_often():
+            threads = [threading.Thread(target=worker, args=(number, )) for number in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(30)
+
+        self.assertEqual([], errors)
+
+    @test.utils.override_settings(DJANGOCACHE_STATS_SINKS=[
+        {'BACKEND': 'djangocache.MemoryStatsSink'},
+        {'BACKEND': 'djangocache.LoggingStatsSink', 'OPTIONS': {'logger': 'tests.events'}},
+    ])
+    def test_stats(self):
+        client = test.Client()
+        memory_sink, logging_sink = get_stats_sinks()
+
+        with mock.patch.object(logging_sink.logger, 'log') as log:
+            # Sun, 17 Jul 2016 10:00:00 GMT
+            with mock.patch.object(time, 'time', return_value=1468749600):
+                client.get(reverse('cache_with_etag'))
+
+            # Sun, 17 Jul 2016 10:05:00 GMT
+            with mock.patch.object(time, 'time', return_value=1468749900):
+                client.get(reverse('cache_with_etag'))
+                client.get(reverse('cache_with_etag'), HTTP_IF_NONE_MATCH='"etag"')
+                client.get(reverse('cache_with_etag'), HTTP_CACHE_CONTROL='max-age=0')
+                client.post(reverse('cache_with_etag'))
+
+        stats = memory_sink.stats()['cache_with_etag']
+        self.assertEqual(1, stats['miss'])  # POST is not counted
+        self.assertEqual(2, stats['write'])
+        if django.VERSION >= (1, 9):
+            self.assertEqual(1, stats['hit'])
+            self.assertEqual(1, stats['not_modified'])
+        else:
+            # Django 1.8 can't make "304 Not Modified"
+            self.assertEqual(2, stats['hit'])
+        self.assertEqual(1, stats['bypass'])
+        self.assertGreater(stats['lookup_time'], 0)
+        self.assertEqual(0.5, memory_sink.hit_ratio('cache_with_etag'))
+
+        self.assertEqual(6, log.call_count)
+        events = [call[1]['extra']['cache_event'] for call in log.call_args_list]
+        self.assertEqual(
+            ['miss', 'write', 'hit', 'not_modified' if django.VERSION >= (1, 9) else 'hit', 'bypass', 'write'],
+            [event['name'] for event in events],
+        )
+        self.assertEqual(300, events[2]['age'])
+        self.assertEqual(0, events[2]['size'])
+
+        # early regenerations are not hits
+        memory_sink.emit(CacheEvent('early_expiration', 'cache_with_etag', None))
+        self.assertEqual(0.4, memory_sink.hit_ratio('cache_with_etag'))
+
+    @test.utils.override_settings(DJANGOCACHE_SERVER_TIMING=True)
+    def test_server_timing(self):
+        client = test.Client()
+
+        def phases(response):
+            return [metric.split(';')[0] for metric in response['Server-Timing'].split(', ')]
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            response = client.get(reverse('cache_with_etag'))
+            self.assertTrue(response['Server-Timing'].startswith('cache;desc="miss", lookup;dur='))
+            self.assertEqual(['cache', 'lookup', 'view'], phases(response))
+
+            response = client.get(reverse('cache_with_etag'))
+            # timings of the first request are not cached
+            self.assertTrue(response['Server-Timing'].startswith('cache;desc="hit", lookup;dur='))
+            self.assertEqual(['cache', 'lookup', 'decode', 'conditional'], phases(response))
+
+            response = client.get(reverse('cache_with_etag'), HTTP_CACHE_CONTROL='max-age=0')
+            self.assertTrue(response['Server-Timing'].startswith('cache;desc="bypass", '))
+            self.assertEqual(['cache', 'lookup', 'decode', 'conditional', 'view'], phases(response))
+
+            if django.VERSION >= (1, 9):
+                response = client.get(reverse('cache_with_etag'), HTTP_IF_NONE_MATCH='"etag"')
+                self.assertEqual(304, response.status_code)
+                self.assertTrue(response['Server-Timing'].startswith('cache;desc="not_modified", '))
+
+            with test.utils.override_settings(DJANGOCACHE_SERVER_TIMING=False):
+                self.assertNotIn('Server-Timing', client.get(reverse('cache_with_etag')))
+
+            # header removed by other middleware
+            with test.utils.override_settings(MIDDLEWARE_CLASSES=[__name__ + '.RemoveServerTimingMiddleware']):
+                response = test.Client().get(reverse('cache_with_last_modified'))
+                self.assertNotIn('Server-Timing', response)
+            response = client.get(reverse('cache_with_last_modified'))
+            self.assertTrue(response['Server-Timing'].startswith('cache;desc="hit", '))
+
+    def test_statsd_sink(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(5)
+        self.addCleanup(server.close)
+        sink = StatsdStatsSink(host='127.0.0.1', port=server.getsockname()[1], prefix='site')
+        sink.emit(CacheEvent('hit', 'app:view', 'prefix', age=10, size=100, lookup_time=0.0015))
+        self.assertEqual(
+            [
+                b'site.app_view.hit:1|c',
+                b'site.app_view.lookup_time:1.500|ms',
+                b'site.app_view.size:100|h',
+                b'site.app_view.age:10|h',
+            ],
+            server.recv(1024).split(b'\n'),
+        )
+
+    def test_early_expiration(self):
+        client = test.Client()
+        cache = caches[settings.CACHE_MIDDLEWARE_ALIAS]
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            response = client.get(reverse('early_expiration'))
+            mocked_response.assert_called_once()
+            mocked_response.reset_mock()
+            record = cache.get(get_cache_key(response.wsgi_request, cache=cache))
+            self.assertGreaterEqual(decode_response(record)._cache_regeneration_time, 0.01)
+
+        for timestamp, chance, regenerated in (
+            (1468749900, 0.999, False),  # 300 seconds before expiration
+            (1468750195, 0.5, False),  # 5 seconds before expiration
+            (1468750195, 0.999, True),
+        ):
+            with mock.patch.object(time, 'time', return_value=timestamp):
+                with mock.patch.object(random, 'random', return_value=chance):
+                    response = client.get(reverse('early_expiration'))
+            self.assertEqual(regenerated, mocked_response.called)
+            self.assertEqual(not regenerated, 'Age' in response)
+            mocked_response.reset_mock()
+
+        # expiration is postponed by the regenerated page
+        with mock.patch.object(time, 'time', return_value=1468750195):
+            with mock.patch.object(random, 'random', return_value=0.999):
+                response = client.get(reverse('early_expiration'))
+        mocked_response.assert_not_called()
+
+        if django.VERSION >= (1, 9):
+            # conditional requests expire early too
+            etag = response['ETag']
+            for timestamp, regenerated, status_code in (
+                (1468750495, False, 304),
+                (1468750790, True, 200),
+            ):
+                with mock.patch.object(time, 'time', return_value=timestamp):
+                    with mock.patch.object(random, 'random', return_value=0.999):
+                        response = client.get(reverse('early_expiration'), HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(regenerated, mocked_response.called)
+                self.assertEqual(status_code, response.status_code)
+                mocked_response.reset_mock()
+
+        # chance is drawn once per request
+        request = test.RequestFactory().get('/')
+        response = http.HttpResponse()
+        response._cache_regeneration_time = 0.01
+        middleware = CacheMiddleware(early_expiration=100)
+        with mock.patch.object(random, 'random', return_value=0.999) as random_mock:
+            self.assertTrue(middleware.is_expired_early(request, response, 5))
+            self.assertTrue(middleware.is_expired_early(request, response, 5))
+        random_mock.assert_called_once_with()
+
+    def test_namespace(self):
+        client = test.Client()
+
+        def get(tenant, requests=1):
+            for _ in range(requests):
+                with mock.patch.object(LocMemCache, 'get_many', autospec=True, side_effect=LocMemCache.get_many) as get_many:
+                    client.get(reverse('namespaced'), dict(tenant=tenant))
+            return get_many.call_count
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            get('a', requests=2)
+            get('b', requests=2)
+            self.assertEqual(2, mocked_response.call_count)
+            mocked_response.reset_mock()
+
+            # generation is checked by the same get_many as the page
+            self.assertEqual(1, get('a'))
+            mocked_response.assert_not_called()
+
+            invalidate_namespace('tenant.a')
+            self.assertEqual(1, get('b'))
+            mocked_response.assert_not_called()
+            get('a')
+            mocked_response.assert_called_once()
+            mocked_response.reset_mock()
+            get('a')
+            mocked_response.assert_not_called()
+
+            # generation is changed by another process
+            caches['default'].incr('djangocache.namespace.tenant.b')
+            self.assertEqual(2, get('b'))
+            mocked_response.assert_called_once()
+            mocked_response.reset_mock()
+
+            # generation is evicted from cache
+            caches['default'].delete('djangocache.namespace.tenant.a')
+            get('a')
+            mocked_response.assert_called_once()
+
+    def test_purge(self):
+        client = test.Client()
+        cache = caches[settings.CACHE_MIDDLEWARE_ALIAS]
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            for x_header in ('1', '2'):
+                client.get(reverse('indexed'), HTTP_X_HEADER=x_header)
+                client.get(reverse('vary'), HTTP_X_HEADER=x_header)
+            client.get(reverse('vary'))
+            client.get(reverse('precompressed'))
+            client.get(reverse('precompressed'), HTTP_ACCEPT_ENCODING='gzip')
+            client.get(reverse('static'))
+            self.assertEqual(7, mocked_response.call_count)
+            mocked_response.reset_mock()
+
+            keys = purge(reverse('indexed'), host='testserver')
+            self.assertEqual(4, len(keys))  # headers list, index and 2 pages
+            self.assertEqual([], [key for key in keys if cache.get(key) is not None])
+            purge('http://testserver' + reverse('precompressed'))
+            # only the version for the request without headers can be found without index
+            purge(reverse('vary'), host='testserver')
+
+            for x_header in ('1', '2'):
+                client.get(reverse('indexed'), HTTP_X_HEADER=x_header)
+            self.assertEqual(2, mocked_response.call_count)
+            mocked_response.reset_mock()
+            client.get(reverse('precompressed'), HTTP_ACCEPT_ENCODING='gzip')
+            mocked_response.assert_called_once()
+            mocked_response.reset_mock()
+            client.get(reverse('vary'))
+            mocked_response.assert_called_once()
+            mocked_response.reset_mock()
+
+            # other pages are not affected
+            client.get(reverse('static'))
+            mocked_response.assert_not_called()
+
+            with self.assertRaises(ValueError):
+                purge(reverse('static'))
+
+    def test_purge_write_behind(self):
+        client = test.Client()
+        cache = caches[settings.CACHE_MIDDLEWARE_ALIAS]
+        queue = get_write_behind_queue()
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            with queue.flush_lock:  # suspend background flushes
+                for x_header in ('1', '2', '3'):
+                    client.get(reverse('indexed_queued'), HTTP_X_HEADER=x_header)
+                self.assertEqual(3, queue.depth)
+            # fills of the same batch don't override each other's index
+            queue.flush()
+            self.assertEqual(3, mocked_response.call_count)
+            mocked_response.reset_mock()
+
+            keys = purge(reverse('indexed_queued'), host='testserver')
+            self.assertEqual(5, len(keys))  # headers list, index and 3 pages
+            self.assertEqual([], [key for key in keys if cache.get(key) is not None])
+            for x_header in ('1', '2', '3'):
+                client.get(reverse('indexed_queued'), HTTP_X_HEADER=x_header)
+            self.assertEqual(3, mocked_response.call_count)
+
+    def test_purge_local_cache(self):
+        client = test.Client()
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            for x_header in ('1', '2'):
+                client.get(reverse('indexed_tiered'), HTTP_X_HEADER=x_header)
+                client.get(reverse('indexed_tiered'), HTTP_X_HEADER=x_header)
+            self.assertEqual(2, mocked_response.call_count)
+            mocked_response.reset_mock()
+
+            keys = purge(reverse('indexed_tiered'), host='testserver')
+            self.assertEqual(4, len(keys))  # headers list, index and 2 pages
+            # pages are removed from the local cache too
+            for x_header in ('1', '2'):
+                client.get(reverse('indexed_tiered'), HTTP_X_HEADER=x_header)
+            self.assertEqual(2, mocked_response.call_count)
+            mocked_response.reset_mock()
+
+            # index is never kept by the local cache, so the next purge
+            # finds versions cached after the previous one
+            client.get(reverse('indexed_tiered'), HTTP_X_HEADER='3')
+            keys = purge(reverse('indexed_tiered'), host='testserver')
+            self.assertEqual(5, len(keys))
+            for x_header in ('1', '2', '3'):
+                client.get(reverse('indexed_tiered'), HTTP_X_HEADER=x_header)
+            self.assertEqual(4, mocked_response.call_count)
+
+    @test.utils.override_settings(LANGUAGE_CODE='en', LANGUAGES=[('en', 'English'), ('de', 'German')])
+    def test_purge_namespace_language(self):
+        client = test.Client()
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            with translation.override('de'):
+                client.get(reverse('indexed_tenant'), HTTP_X_HEADER='1')
+            client.get(reverse('indexed_tenant'), HTTP_X_HEADER='1')
+            self.assertEqual(2, mocked_response.call_count)
+            mocked_response.reset_mock()
+
+            # the key is derived with the generation of the namespace
+            self.assertEqual([], purge(reverse('indexed_tenant'), host='testserver', namespace='other'))
+            keys = purge(reverse('indexed_tenant'), host='testserver', namespace='indexed', language='de')
+            self.assertEqual(3, len(keys))  # headers list, index and the page
+
+            # the page of the active language is not affected
+            client.get(reverse('indexed_tenant'), HTTP_X_HEADER='1')
+            mocked_response.assert_not_called()
+            with translation.override('de'):
+                client.get(reverse('indexed_tenant'), HTTP_X_HEADER='1')
+            mocked_response.assert_called_once()
+
+    def test_query_params(self):
+        client = test.Client()
+        url = reverse('canonical_query')
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            response = client.get(url + '?b=2&a=1&utm_source=x')
+            mocked_response.assert_called_once()
+            # view gets the original request
+            self.assertEqual(url + '?b=2&a=1&utm_source=x', response.content.decode())
+            mocked_response.reset_mock()
+
+            for query in ('a=1&b=2', 'b=2&a=1', 'a=1&fbclid=y&b=2&utm_medium=z'):
+                response = client.get(url + '?' + query)
+                self.assertEqual('0', response['Age'])
+            mocked_response.assert_not_called()
+
+            # order of values of the same parameter matters
+            client.get(url + '?a=2&a=1&b=2')
+            client.get(url + '?a=1&b=2&a=2')
+            self.assertEqual(2, mocked_response.call_count)
+            mocked_response.reset_mock()
+
+            client.get(reverse('allowed_query') + '?page=2&sort=name')
+            response = client.get(reverse('allowed_query') + '?sort=date&page=2')
+            self.assertEqual('0', response['Age'])
+            client.get(reverse('allowed_query') + '?page=3')
+            self.assertEqual(2, mocked_response.call_count)
+            mocked_response.reset_mock()
+
+            client.get(reverse('ignored_query') + '?page=2')
+            response = client.get(reverse('ignored_query'))
+            self.assertEqual('0', response['Age'])
+            mocked_response.assert_called_once()
+
+            purge(url + '?utm_source=x&b=2&a=1', host='testserver', query_params={'deny': ['utm_*']})
+            mocked_response.reset_mock()
+            client.get(url + '?a=1&b=2')
+            mocked_response.assert_called_once()
+
+        with self.assertRaises(ImproperlyConfigured):
+            get_query_params(['page'])
+
+    @test.utils.override_settings(LANGUAGE_CODE='en', LANGUAGES=[('en', 'English'), ('de', 'German')])
+    def test_vary_normalizers(self):
+        client = test.Client()
+        chrome = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 Chrome/58.0 Safari/537.36'
+        iphone = 'Mozilla/5.0 (iPhone; CPU iPhone OS 10_3 like Mac OS X) Mobile/14E277 Safari/602.1'
+        android = 'Mozilla/5.0 (Linux; Android 7.0; SM-G930F) Chrome/58.0 Mobile Safari/537.36'
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            response = client.get(
+                reverse('normalized'),
+                HTTP_ACCEPT_ENCODING='gzip, deflate, br',
+                HTTP_ACCEPT_LANGUAGE='de-DE,de;q=0.9,en;q=0.8',
+                HTTP_USER_AGENT=iphone,
+            )
+            # view gets normalized headers
+            self.assertEqual(b'br, gzip|de|mobile', response.content)
+            mocked_response.assert_called_once()
+            mocked_response.reset_mock()
+
+            response = client.get(
+                reverse('normalized'),
+                HTTP_ACCEPT_ENCODING='br;q=1.0, gzip;q=0.8, *;q=0.1',
+                HTTP_ACCEPT_LANGUAGE='de-AT',
+                HTTP_USER_AGENT=android,
+            )
+            self.assertEqual(b'br, gzip|de|mobile', response.content)
+            self.assertEqual('0', response['Age'])
+            mocked_response.assert_not_called()
+
+            response = client.get(
+                reverse('normalized'),
+                HTTP_ACCEPT_ENCODING='gzip;q=0, identity',
+                HTTP_ACCEPT_LANGUAGE='fr-FR,fr;q=0.9',
+                HTTP_USER_AGENT=chrome,
+            )
+            self.assertEqual(b'identity|en|desktop', response.content)
+            mocked_response.assert_called_once()
+
+        for normalizer, values in (
+            (normalize_accept_encoding, ['gzip', 'gzip, deflate', 'identity', '*']),
+            (normalize_accept_language, ['en-US,en;q=0.5', 'de', '*']),
+            (normalize_user_agent, [chrome, iphone, 'Googlebot/2.1 (+http://www.google.com/bot.html)']),
+        ):
+            for value in values:
+                # normalization is idempotent
+                self.assertEqual(normalizer(value), normalizer(normalizer(value)))
+        self.assertEqual('bot', normalize_user_agent('Googlebot/2.1 (+http://www.google.com/bot.html)'))
+
+        # encodings refused by client are never chosen
+        self.assertEqual('br', normalize_accept_encoding('gzip;q=0, *'))
+        self.assertEqual('gzip', normalize_accept_encoding('br;level=5;q=0, gzip'))
+        self.assertEqual('gzip', normalize_accept_encoding('br; q=0.0, gzip; q=0.5'))
+        self.assertEqual('identity', normalize_accept_encoding('*;q=0, identity'))
+        self.assertEqual('br, gzip', normalize_accept_encoding('*'))
+
+        with self.assertRaises(ImproperlyConfigured):
+            cache_page(vary_normalizers={'Content-Type': lambda value: value})
+
+    def test_cookies(self):
+        client = test.Client()
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            client.get(reverse('session_cookie'), HTTP_COOKIE='_ga=1')
+            mocked_response.assert_called_once()
+            mocked_response.reset_mock()
+
+            # anonymous visitors with different analytics cookies share the page
+            for cookie in ('_ga=2; _gid=3', 'csrftoken=x; _ga=4', ''):
+                response = client.get(reverse('session_cookie'), HTTP_COOKIE=cookie)
+                self.assertEqual(b'anonymous', response.content)
+                self.assertEqual('0', response['Age'])
+            mocked_response.assert_not_called()
+
+            # session cookie makes its own version of the page
+            response = client.get(reverse('session_cookie'), HTTP_COOKIE='_ga=1; sessionid=abc')
+            self.assertEqual(b'abc', response.content)
+            mocked_response.assert_called_once()
+            mocked_response.reset_mock()
+            response = client.get(reverse('session_cookie'), HTTP_COOKIE='sessionid=abc; _gid=5')
+            self.assertEqual(b'abc', response.content)
+            response = client.get(reverse('session_cookie'), HTTP_COOKIE='sessionid=def')
+            self.assertEqual(b'def', response.content)
+            mocked_response.assert_called_once()
+            mocked_response.reset_mock()
+
+            client.get(reverse('analytics_cookies'), HTTP_COOKIE='_ga=1; __utma=2')
+            response = client.get(reverse('analytics_cookies'), HTTP_COOKIE='_gid=3')
+            self.assertEqual('0', response['Age'])
+            client.get(reverse('analytics_cookies'), HTTP_COOKIE='_ga=1; theme=dark')
+            self.assertEqual(2, mocked_response.call_count)
+            mocked_response.reset_mock()
+
+            # session cookie set for the visitor having only
+            # non-selected cookies is not shared with others
+            response = client.get(reverse('session_start'), HTTP_COOKIE='_ga=1')
+            self.assertEqual('session-1', response.cookies['sessionid'].value)
+            response = client.get(reverse('session_start'), HTTP_COOKIE='_ga=2')
+            self.assertNotIn('Age', response)
+            self.assertEqual('session-2', response.cookies['sessionid'].value)
+            self.assertEqual(2, mocked_response.call_count)
+
+        with self.assertRaises(ImproperlyConfigured):
+            get_cookies('sessionid')
+
+    @test.utils.override_settings(DJANGOCACHE_STATS_SINKS=[
+        {'BACKEND': 'djangocache.MemoryStatsSink'},
+    ])
+    def test_bypass_limit(self):
+        client = test.Client()
+        sink, = get_stats_sinks()
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            client.get(reverse('throttled'))
+            mocked_response.assert_called_once()
+            mocked_response.reset_mock()
+
+        # Sun, 17 Jul 2016 10:05:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749900):
+            response = client.get(reverse('throttled'), HTTP_CACHE_CONTROL='max-age=0')
+            mocked_response.assert_called_once()
+            self.assertNotIn('Age', response)
+            mocked_response.reset_mock()
+
+            # other forced bypasses get the fresh copy
+            response = client.get(reverse('throttled'), HTTP_CACHE_CONTROL='max-age=0')
+            self.assertEqual('0', response['Age'])
+            response = client.get(reverse('throttled'), HTTP_PRAGMA='no-cache')
+            self.assertEqual('0', response['Age'])
+            mocked_response.assert_not_called()
+
+        # Sun, 17 Jul 2016 10:06:01 GMT
+        with mock.patch.object(time, 'time', return_value=1468749961):
+            # the next window
+            response = client.get(reverse('throttled'), HTTP_CACHE_CONTROL='max-age=0')
+            mocked_response.assert_called_once()
+            self.assertNotIn('Age', response)
+
+        stats = sink.stats()['throttled']
+        self.assertEqual(2, stats['bypass'])
+        self.assertEqual(2, stats['bypass_throttled'])
+        self.assertEqual(0.4, sink.hit_ratio('throttled'))
+
+        # backends without native `incr` reset expiration time of the counter
+        mocked_response.reset_mock()
+        with mock.patch.object(LocMemCache, 'incr', BaseCache.incr):
+            # Sun, 17 Jul 2016 10:07:05 GMT
+            with mock.patch.object(time, 'time', return_value=1468750025):
+                client.get(reverse('throttled'), HTTP_CACHE_CONTROL='max-age=0')
+                client.get(reverse('throttled'), HTTP_CACHE_CONTROL='max-age=0')
+                self.assertEqual(1, mocked_response.call_count)
+                mocked_response.reset_mock()
+
+            # Sun, 17 Jul 2016 10:08:01 GMT
+            with mock.patch.object(time, 'time', return_value=1468750081):
+                client.get(reverse('throttled'), HTTP_CACHE_CONTROL='max-age=0')
+                mocked_response.assert_called_once()
+
+    @test.utils.override_settings(ROOT_URLCONF=warm_urls)
+    def test_warm(self):
+        arguments = tempfile.NamedTemporaryFile('w', suffix='.json')
+        self.addCleanup(arguments.close)
+        json.dump({'article': [{'slug': 'first'}, ['second']]}, arguments)
+        arguments.flush()
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            output = six.StringIO()
+            with mock.patch.object(db.connections, 'close_all') as close_all:
+                management.call_command(
+                    'djangocache_warm',
+                    arguments=arguments.name,
+                    sitemaps=['/sitemap.xml'],
+                    host='testserver',
+                    concurrency=2,
+                    stdout=output,
+                    verbosity=2,
+                )
+            # connections of worker threads are closed
+            self.assertEqual(2, close_all.call_count)
+            self.assertEqual(4, mocked_response.call_count)  # no_cache is skipped
+            self.assertIn('Requested 4 pages: 4 filled (miss), 0 already cached (hit), 0 errors', output.getvalue())
+            self.assertIn('MISS  200', output.getvalue())
+            mocked_response.reset_mock()
+
+            client = test.Client()
+            for path in ('/', '/articles/first', '/articles/second', '/articles/sitemap'):
+                client.get(path)
+            mocked_response.assert_not_called()
+
+            output = six.StringIO()
+            management.call_command('djangocache_warm', host='testserver', dry_run=True, stdout=output)
+            self.assertEqual('/\n', output.getvalue())
+
+    @test.utils.override_settings(ROOT_URLCONF=warm_cookie_urls)
+    def test_warm_cookies(self):
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            management.call_command('djangocache_warm', host='testserver', concurrency=1, stdout=six.StringIO())
+            self.assertEqual(2, mocked_response.call_count)
+            mocked_response.reset_mock()
+
+            # pages are filled for visitors without cookies
+            response = test.Client().get('/b')
+            mocked_response.assert_not_called()
+            self.assertEqual('0', response['Age'])
+
+    @test.utils.override_settings(MIDDLEWARE_CLASSES=[
+        'djangocache.EarlyCacheMiddleware',
+        __name__ + '.CountingMiddleware',
+    ])
+    def test_early_middleware(self):
+        client = test.Client()
+        CountingMiddleware.calls = 0
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            response = client.get(reverse('early'))
+            mocked_response.assert_called_once()
+            self.assertEqual(1, CountingMiddleware.calls)
+            self.assertNotIn('Age', response)
+            mocked_response.reset_mock()
+
+        # Sun, 17 Jul 2016 10:05:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749900):
+            # hits are served before the rest of middleware
+            response = client.get(reverse('early'))
+            self.assertEqual(200, response.status_code)
+            self.assertEqual('300', response['Age'])
+            if django.VERSION >= (1, 9):
+                response = client.get(reverse('early'), HTTP_IF_NONE_MATCH='"etag"')
+                self.assertEqual(304, response.status_code)
+            mocked_response.assert_not_called()
+            self.assertEqual(1, CountingMiddleware.calls)
+
+            # bypass is handled by the view middleware
+            response = client.get(reverse('early'), HTTP_CACHE_CONTROL='max-age=0')
+            mocked_response.assert_called_once()
+            self.assertEqual(2, CountingMiddleware.calls)
+            self.assertNotIn('Age', response)
+
+            # views without early=True are not affected
+            client.get(reverse('static'))
+            client.get(reverse('static'))
+            self.assertEqual(4, CountingMiddleware.calls)
+
+    @test.utils.override_settings(MIDDLEWARE_CLASSES=['djangocache.EarlyCacheMiddleware'])
+    @test.utils.override_settings(
+        MIDDLEWARE_CLASSES=['djangocache.EarlyCacheMiddleware', 'django.middleware.locale.LocaleMiddleware'],
+        LANGUAGE_CODE='en',
+        LANGUAGES=[('en', 'English'), ('de', 'German')],
+    )
+    def test_early_middleware_language(self):
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            german_client = test.Client()
+            german_client.cookies[settings.LANGUAGE_COOKIE_NAME] = 'de'
+            self.assertEqual(b'de', german_client.get(reverse('early_translated')).content)
+
+            # language of the previous request is still active
+            with translation.override('de'):
+                response = test.Client().get(reverse('early_translated'))
+            self.assertEqual(b'en', response.content)
+            self.assertEqual(2, mocked_response.call_count)
+            mocked_response.reset_mock()
+
+            with translation.override('de'):
+                response = test.Client().get(reverse('early_translated'))
+            self.assertEqual(b'en', response.content)
+            self.assertEqual('0', response['Age'])
+            with translation.override('en'):
+                response = german_client.get(reverse('early_translated'))
+            self.assertEqual(b'de', response.content)
+            self.assertEqual('0', response['Age'])
+            mocked_response.assert_not_called()
+
+    def test_early_middleware_miss(self):
+        client = test.Client()
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            with mock.patch.object(LocMemCache, 'get_many', autospec=True, side_effect=LocMemCache.get_many) as get_many:
+                with mock.patch.object(LocMemCache, 'get', autospec=True, side_effect=LocMemCache.get) as get:
+                    client.get(reverse('early_refreshed'), HTTP_USER_AGENT='Mozilla/5.0 (iPhone)')
+            mocked_response.assert_called_once()
+            mocked_response.reset_mock()
+            # the view middleware reuses the lookup made by the early one
+            self.assertEqual(1, get_many.call_count)
+            self.assertEqual(2, get.call_count)  # by get_many()
+
+        # Sun, 17 Jul 2016 10:12:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468750320):
+            # stale page is served by the early middleware and refreshed
+            # by the request with normalized headers
+            response = client.get(reverse('early_refreshed'), HTTP_USER_AGENT='Mozilla/5.0 (Android; Mobile)')
+            self.assertEqual(b'mobile', response.content)
+            self.assertEqual('110 - "Response is Stale"', response['Warning'])
+            get_refresh_executor().queue.join()
+            mocked_response.assert_called_once()
+            mocked_response.reset_mock()
+
+            response = client.get(reverse('early_refreshed'), HTTP_USER_AGENT='Mozilla/5.0 (iPhone)')
+            mocked_response.assert_not_called()
+            self.assertEqual(b'mobile', response.content)
+            self.assertEqual('0', response['Age'])
+
+    def test_local_cache(self):
+        client = test.Client()
+        local_cache = local_caches[settings.CACHE_MIDDLEWARE_ALIAS, 1024 * 1024, 5]
+        hits = local_cache.hits
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            client.get(reverse('local'))
+            mocked_response.assert_called_once()
+            mocked_response.reset_mock()
+
+        # shared cache is empty, but page is still in the local one
+        caches[settings.CACHE_MIDDLEWARE_ALIAS].clear()
+
+        # Sun, 17 Jul 2016 10:00:04 GMT
+        with mock.patch.object(time, 'time', return_value=1468749604):
+            response = client.get(reverse('local'))
+            mocked_response.assert_not_called()
+            self.assertEqual('4', response['Age'])
+            self.assertEqual(hits + 2, local_cache.hits)  # headers list and page
+
+        # Sun, 17 Jul 2016 10:00:05 GMT
+        with mock.patch.object(time, 'time', return_value=1468749605):
+            response = client.get(reverse('local'))
+            mocked_response.assert_called_once()
+            self.assertNotIn('Age', response)
+
+    def test_local_cache_control_keys(self):
+        client = test.Client()
+        local_cache = local_caches[settings.CACHE_MIDDLEWARE_ALIAS, 1024 * 1024, 5]
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            client.get(reverse('tiered_tenant'))
+            client.get(reverse('tiered_tenant'))
+            mocked_response.assert_called_once()
+            mocked_response.reset_mock()
+            # only headers lists and pages are kept by L1
+            self.assertEqual(
+                [],
+                [key for key in local_cache.entries if not key.startswith('views.decorators.cache.cache_')],
+            )
+            self.assertEqual([], [key for key in local_cache.entries if key.endswith('.lock')])
+
+            # namespace is invalidated by another process
+            caches[settings.CACHE_MIDDLEWARE_ALIAS].incr('djangocache.namespace.tiered')
+            client.get(reverse('tiered_tenant'))
+            mocked_response.assert_called_once()
+
+    def test_local_cache_lru(self):
+        local_cache = LocalCache(max_size=100, ttl=5)
+        size = sum(
+            len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+            for value in ('a' * 30, 'c' * 30)
+        )
+        local_cache.set('a', 'a' * 30)
+        local_cache.set('b', 'b' * 30)
+        self.assertEqual('a' * 30, local_cache.get('a'))
+        local_cache.set('c', 'c' * 30)
+        self.assertEqual(size, local_cache.size)
+        self.assertEqual(1, local_cache.evictions)
+        self.assertIsNone(local_cache.get('b'))
+        self.assertEqual('a' * 30, local_cache.get('a'))
+        self.assertEqual('c' * 30, local_cache.get('c'))
+        local_cache.set('d', 'd' * 100)  # too big
+        self.assertIsNone(local_cache.get('d'))
+        self.assertEqual(dict(
+            hits=3,
+            misses=2,
+            evictions=1,
+            rejections=0,
+            size=size,
+            entries=2,
+        ), local_cache.stats())
+
+    def test_local_cache_admission(self):
+        local_cache = LocalCache(max_size=100, ttl=5, sketch=CountMinSketch(width=64))
+        for _ in range(3):
+            local_cache.get('a')
+        local_cache.set('a', 'a' * 30)
+        local_cache.set('b', 'b' * 30)
+        self.assertEqual('a' * 30, local_cache.get('a'))
+
+        # requested only once, less than "b" would be evicted
+        local_cache.set('c', 'c' * 30)
+        self.assertEqual(1, local_cache.rejections)
+        self.assertIsNone(local_cache.get('c'))
+        self.assertEqual('b' * 30, local_cache.get('b'))
+
+        # requested more often than the least recently used "a"
+        for _ in range(5):
+            local_cache.get('c')
+        local_cache.set('c', 'c' * 30)
+        self.assertEqual('c' * 30, local_cache.get('c'))
+        self.assertIsNone(local_cache.get('a'))
+        self.assertEqual(1, local_cache.evictions)
+
+    def test_count_min_sketch(self):
+        # wide enough to make collisions of the keys improbable
+        sketch = CountMinSketch(width=65536, depth=4, sample_size=100)
+        for _ in range(20):
+            sketch.add('popular')
+        sketch.add('rare')
+        self.assertEqual(15, sketch.estimate('popular'))  # 4-bit counters
+        self.assertGreaterEqual(sketch.estimate('rare'), 1)
+        self.assertEqual(0, sketch.estimate('unknown'))
+        for i in range(79):
+            sketch.add(i)
+        # counters are halved after 100 additions
+        self.assertEqual(1, sketch.stats()['resets'])
+        self.assertEqual(50, sketch.stats()['additions'])
+        self.assertEqual(7, sketch.estimate('popular'))
+        self.assertEqual(0, sketch.estimate('rare'))
+
+    @test.utils.override_settings(DJANGOCACHE_STATS_SINKS=[
+        {'BACKEND': 'djangocache.MemoryStatsSink'},
+    ])
+    def test_admission(self):
+        client = test.Client()
+        sink, = get_stats_sinks()
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            # the first miss is not cached
+            response = client.get(reverse('admitted'), {'page': 1})
+            mocked_response.assert_called_once()
+            self.assertNotIn('Age', response)
+            mocked_response.reset_mock()
+            response = client.get(reverse('admitted'), {'page': 1})
+            mocked_response.assert_called_once()
+            self.assertNotIn('Age', response)
+            mocked_response.reset_mock()
+
+            # cached by the second one
+            response = client.get(reverse('admitted'), {'page': 1})
+            mocked_response.assert_not_called()
+            self.assertEqual('0', response['Age'])
+
+            # other pages are counted separately
+            client.get(reverse('admitted'), {'page': 2})
+            mocked_response.assert_called_once()
+
+            stats = sink.stats()['admitted']
+            self.assertEqual(3, stats['miss'])
+            self.assertEqual(2, stats['not_admitted'])
+            self.assertEqual(1, stats['write'])
+            self.assertEqual(1, stats['hit'])
+
+        # expired page is missed again, but it's already popular
+        # Sun, 17 Jul 2016 10:10:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468750200):
+            mocked_response.reset_mock()
+            client.get(reverse('admitted'), {'page': 1})
+            mocked_response.assert_called_once()
+            mocked_response.reset_mock()
+            response = client.get(reverse('admitted'), {'page': 1})
+            mocked_response.assert_not_called()
+            self.assertGreaterEqual(get_admission_sketch().stats()['additions'], 4)
+
+    def test_encode_decode_response(self):
+        response = http.HttpResponse(b'body', status=201, content_type='text/plain; charset=latin-1')
+        response['ETag'] = '"etag"'
+        record = encode_response(response, regeneration_time=0.5)
+        self.assertIsInstance(record, bytes)
+        decoded = decode_response(record)
+        self.assertEqual(0.5, decoded._cache_regeneration_time)
+        self.assertEqual(201, decoded.status_code)
+        self.assertEqual(b'body', decoded.content)
+        self.assertEqual('latin-1', decoded.charset)
+        self.assertEqual(sorted(response.items()), sorted(decoded.items()))
+
+        self.assertIsNone(decode_response(b'\xff' + record[1:]))  # unknown version
+        self.assertIsNone(decode_response(b''))
+
+        response.set_cookie('cookie', 'value')
+        self.assertIs(response, encode_response(response))
+        self.assertIs(response, decode_response(response))
+
+    def test_pickled_response_in_cache(self):
+        client = test.Client()
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            response = client.get(reverse('default'))
+            mocked_response.assert_called_once()
+            mocked_response.reset_mock()
+
+            request = test.RequestFactory().get(reverse('default'))
+            cache_key = get_cache_key(request, cache=caches[settings.CACHE_MIDDLEWARE_ALIAS])
+            cache = caches[settings.CACHE_MIDDLEWARE_ALIAS]
+            self.assertIsInstance(cache.get(cache_key), bytes)
+            pickled_response = http.HttpResponse(b'pickled')
+            pickled_response['Expires'] = response['Expires']
+            pickled_response['Cache-Control'] = response['Cache-Control']
+            cache.set(cache_key, pickled_response)
+
+            response = client.get(reverse('default'))
+            mocked_response.assert_not_called()
+            self.assertEqual(b'pickled', response.content)
+
+            cache.set(cache_key, b'\xff')  # unknown format
+            response = client.get(reverse('default'))
+            mocked_response.assert_called_once()
+            self.assertIsInstance(cache.get(cache_key), bytes)
+            self.assertEqual(b'', response.content)
+
+    def test_compress(self):
+        client = test.Client()
+        cache = caches[settings.CACHE_MIDDLEWARE_ALIAS]
+        compression_stats.reset()
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            for size in (100, 10):
+                url = reverse('compressed') + '?size={}'.format(size)
+                response = client.get(url)
+                self.assertEqual(b'body' * size, response.content)
+                mocked_response.assert_called_once()
+                mocked_response.reset_mock()
+
+                response = client.get(url)
+                self.assertEqual(b'body' * size, response.content)
+                mocked_response.assert_not_called()
+
+                request = test.RequestFactory().get(url)
+                record = cache.get(get_cache_key(request, cache=cache))
+                self.assertEqual(1 if size == 100 else 0, six.indexbytes(record, 1))
+
+        self.assertEqual(1, compression_stats.compressed)
+        self.assertEqual(0, compression_stats.skipped)
+        self.assertEqual(1, compression_stats.decompressed)
+        self.assertEqual(400, compression_stats.raw_bytes)
+        self.assertGreater(compression_stats.ratio, 10)
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            # corrupted page is regenerated
+            mocked_response.reset_mock()
+            url = reverse('compressed') + '?size=100'
+            key = get_cache_key(test.RequestFactory().get(url), cache=cache)
+            cache.set(key, cache.get(key)[:-10])
+            response = client.get(url)
+            self.assertEqual(b'body' * 100, response.content)
+            mocked_response.assert_called_once()
+
+    def test_encode_decode_compressed_response(self):
+        response = http.HttpResponse(b'body' * 100)
+        record = encode_response(response, get_codec('zlib'))
+        self.assertLess(len(record), len(encode_response(response)))
+        self.assertEqual(response.content, decode_response(record).content)
+
+        # truncated record
+        self.assertIsNone(decode_response(record[:-10]))
+
+        # records of the previous versions
+        headers = b'content-type\nContent-Type\ntext/html; charset=utf-8'
+        record = struct.pack('!BBHI', 2, 0, 200, len(headers)) + headers + b'body'
+        response = decode_response(record)
+        self.assertEqual(b'body', response.content)
+        self.assertIsNone(response._cache_regeneration_time)
+        record = struct.pack('!BHI', 1, 200, len(headers)) + headers + b'body'
+        response = decode_response(record)
+        self.assertEqual(b'body', response.content)
+        self.assertEqual('text/html; charset=utf-8', response['Content-Type'])
+
+        with self.assertRaises(ImproperlyConfigured):
+            get_codec('unknown')
+
+    def assertGzipped(self, content, response):
+        self.assertEqual('gzip', response['Content-Encoding'])
+        self.assertEqual(content, gzip.GzipFile(fileobj=io.BytesIO(response.content)).read())
+
+    def test_precompress(self):
+        client = test.Client()
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            response = client.get(reverse('precompressed'))
+            mocked_response.assert_called_once()
+            self.assertNotIn('Content-Encoding', response)
+            mocked_response.reset_mock()
+
+            response = client.get(reverse('precompressed'), HTTP_ACCEPT_ENCODING='gzip, deflate')
+            mocked_response.assert_not_called()
+            self.assertGzipped(b'body' * 100, response)
+            self.assertEqual('Accept-Encoding', response['Vary'])
+            self.assertEqual('W/"etag"', response['ETag'])
+            self.assertEqual('0', response['Age'])
+
+            response = client.get(reverse('precompressed'), HTTP_ACCEPT_ENCODING='identity')
+            mocked_response.assert_not_called()
+            self.assertNotIn('Content-Encoding', response)
+            self.assertEqual(b'body' * 100, response.content)
+            self.assertEqual('Accept-Encoding', response['Vary'])
+            self.assertEqual('"etag"', response['ETag'])
+
+            # gzip is refused explicitly
+            for accept_encoding in ('gzip;q=0, identity', 'gzip; q=0, *'):
+                response = client.get(reverse('precompressed'), HTTP_ACCEPT_ENCODING=accept_encoding)
+                self.assertNotEqual('gzip', response.get('Content-Encoding'))
+            mocked_response.assert_not_called()
+
+    @test.utils.override_settings(
+        MIDDLEWARE_CLASSES=['django.middleware.gzip.GZipMiddleware'],
+        MIDDLEWARE=['django.middleware.gzip.GZipMiddleware'],
+    )
+    def test_precompress_with_gzip_middleware(self):
+        client = test.Client()
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            response = client.get(reverse('precompressed'), HTTP_ACCEPT_ENCODING='gzip')
+            mocked_response.assert_called_once()
+            self.assertGzipped(b'body' * 100, response)
+            mocked_response.reset_mock()
+
+            response = client.get(reverse('precompressed'))
+            mocked_response.assert_not_called()
+            self.assertNotIn('Content-Encoding', response)
+            self.assertEqual(b'body' * 100, response.content)
+            self.assertEqual('Accept-Encoding', response['Vary'])
+
+            response = client.get(reverse('precompressed'), HTTP_ACCEPT_ENCODING='gzip')
+            mocked_response.assert_not_called()
+            self.assertGzipped(b'body' * 100, response)
+            self.assertEqual(str(len(response.content)), response['Content-Length'])
+
+    @unittest.skipIf(django.VERSION < (1, 9), 'this test works only with Django>=1.9')
+    def test_validators(self):
+        client = test.Client()
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            response = client.get(reverse('validators'))
+            mocked_response.assert_called_once()
+            self.assertEqual(200, response.status_code)
+            mocked_response.reset_mock()
+
+        # Sun, 17 Jul 2016 10:05:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749900):
+            for conditional_headers in (
+                dict(HTTP_IF_NONE_MATCH='"etag"'),
+                dict(HTTP_IF_MODIFIED_SINCE='Sun, 17 Jul 2016 09:55:00 GMT'),
+            ):
+                with mock.patch.object(LocMemCache, 'get', autospec=True, side_effect=LocMemCache.get) as get:
+                    response = client.get(reverse('validators'), **conditional_headers)
+                mocked_response.assert_not_called()
+                self.assertEqual(304, response.status_code)
+                self.assertEqual('"etag"', response['ETag'])
+                self.assertEqual('Sun, 17 Jul 2016 09:55:00 GMT', response['Last-Modified'])
+                self.assertEqual('Sun, 17 Jul 2016 10:10:00 GMT', response['Expires'])
+                self.assertEqual('300', response['Age'])
+                loaded_keys = [call[0][1] for call in get.call_args_list]
+                self.assertEqual(2, len(loaded_keys))
+                self.assertTrue(loaded_keys[0].startswith('views.decorators.cache.cache_header.'))
+                self.assertTrue(loaded_keys[1].endswith('.validators'))
+
+            # validators don't match, page is loaded
+            with mock.patch.object(LocMemCache, 'get', autospec=True, side_effect=LocMemCache.get) as get:
+                response = client.get(reverse('validators'), HTTP_IF_NONE_MATCH='"another_etag"')
+            mocked_response.assert_not_called()
+            self.assertEqual(200, response.status_code)
+            self.assertEqual('"etag"', response['ETag'])
+            self.assertEqual('300', response['Age'])
+            self.assertEqual(3, get.call_count)
+
+    def test_single_round_trip(self):
+        client = test.Client()
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            client.get(reverse('vary'), HTTP_X_HEADER='1')
+            client.get(reverse('vary'), HTTP_X_HEADER='2')
+            self.assertEqual(2, mocked_response.call_count)
+            mocked_response.reset_mock()
+
+            for x_header in ('1', '2'):
+                with mock.patch.object(LocMemCache, 'get_many', autospec=True, side_effect=LocMemCache.get_many) as get_many:
+                    with mock.patch.object(LocMemCache, 'get', autospec=True, side_effect=LocMemCache.get) as get:
+                        response = client.get(reverse('vary'), HTTP_X_HEADER=x_header)
+                mocked_response.assert_not_called()
+                self.assertEqual(200, response.status_code)
+                # headers list and the page are loaded by the single get_many
+                self.assertEqual(1, get_many.call_count)
+                self.assertEqual(2, get.call_count)
+
+    def test_auto_etag(self):
+        client = test.Client()
+        body_etag = '"{}"'.format(hashlib.md5(b'body').hexdigest())
+
+        # Sun, 17 Jul 2016 10:00:00 GMT
+        with mock.patch.object(time, 'time', return_value=1468749600):
+            client.get(reverse('auto_etag'))
+            mocked_response.assert_called_once()
+            mocked_response.reset_mock()
+
+            response = client.get(reverse('auto_etag'))
+            mocked_response.assert_not_called()
+            self.assertEqual(b'body', response.content)
+            self.assertEqual(body_etag, response['ETag'])
+
+            if django.VERSION >= (1, 9):
+                response = client.get(reverse('auto_etag'), HTTP_IF_NONE_MATCH=body_etag)
+                mocked_response.assert_not_called()
+                self.assertEqual(304, response.status_code)
+                self.assertEqual(body_etag, response['ETag'])